@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(BENCH_DIR), "code")
+BIN_DIR = os.path.join(BENCH_DIR, "bin")
+
+
+def read_io():
+    # /proc/self/io includes the I/O of children that have been waited for
+    with open("/proc/self/io", "r") as io:
+        counters = dict(line.split(": ") for line in io.read().splitlines())
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def count_spawns(spawn_log):
+    if not os.path.exists(spawn_log):
+        return 0
+    with open(spawn_log, "r") as spawns:
+        return sum(1 for _ in spawns)
+
+
+def bench_resources(size):
+    return [
+        {"dashboard": [f"dash-{i}" for i in range(max(1, size // 4))]},
+        {
+            "monitor": [
+                {"ids": list(range(max(1, size // 2)))},
+                {"tags": ["env:bench"]},
+                {"tagsets": [{"team_a": ["team:a"]}, {"team_b": ["team:b"]}]},
+            ]
+        },
+        {"logs_archive_order": None},
+    ]
+
+
+def write_config(path, size, orgs=0):
+    # with orgs, every org imports the same synthetic resources into its own directory
+    config = {"resources": bench_resources(size)}
+    if orgs:
+        config = {
+            "orgs": {
+                f"org{i}": {
+                    "api_key_env": "BENCH_API_KEY",
+                    "app_key_env": "BENCH_APP_KEY",
+                    "resources": bench_resources(size),
+                }
+                for i in range(orgs)
+            }
+        }
+    with open(path, "w") as conf:
+        yaml.safe_dump(config, conf)
+
+
+def run_stage(name, command, env, spawn_log):
+    spawns_before = count_spawns(spawn_log)
+    read_before, written_before = read_io()
+    start = time.monotonic()
+    process = subprocess.Popen(command, env=env, cwd=CODE_DIR)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.monotonic() - start
+    read_after, written_after = read_io()
+    return {
+        "stage": name,
+        "exit_code": process.returncode,
+        "wall_seconds": round(elapsed, 3),
+        "process_spawns": count_spawns(spawn_log) - spawns_before,
+        "bytes_read": read_after - read_before,
+        "bytes_written": written_after - written_before,
+        "peak_rss_kb": usage.ru_maxrss,
+    }
+
+
+def run_benchmark(size, latency, failure_rate, keep, pipelined=False, orgs=0):
+    work_dir = tempfile.mkdtemp(prefix=f"ddtf-bench-{size}-")
+    spawn_log = os.path.join(work_dir, "spawns.log")
+    conf_path = os.path.join(work_dir, "conf.yaml")
+    write_config(conf_path, size, orgs)
+    env = dict(
+        os.environ,
+        TERRAFORM_DIR=work_dir,
+        CONF_PATH=conf_path,
+        TERRAFORMER_BIN=os.path.join(BIN_DIR, "terraformer"),
+        BENCH_RESOURCES=str(size),
+        BENCH_LATENCY=str(latency),
+        BENCH_FAILURE_RATE=str(failure_rate),
+        BENCH_SPAWN_LOG=spawn_log,
+        BENCH_API_KEY="bench",
+        BENCH_APP_KEY="bench",
+        LOGLEVEL=os.environ.get("LOGLEVEL", "ERROR"),
+    )
+    stages = [("init", [os.path.join(BIN_DIR, "terraform"), "validate"])]
+    if pipelined or orgs:
+        stages.append(
+            ("orchestrate", [sys.executable, os.path.join(CODE_DIR, "orchestrate.py")])
+        )
+    else:
+        stages.append(
+            ("configure", [sys.executable, os.path.join(CODE_DIR, "configure.py")])
+        )
+        stages.append(
+            ("migrate", [sys.executable, os.path.join(CODE_DIR, "migrate.py")])
+        )
+    try:
+        results = [run_stage(name, cmd, env, spawn_log) for name, cmd in stages]
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "resources": size,
+        "work_dir": work_dir if keep else None,
+        "stages": results,
+    }
+
+
+def print_results(results):
+    header = f'{"N":>7} {"stage":<11} {"exit":>4} {"wall s":>9} {"spawns":>7} {"read MB":>9} {"write MB":>9} {"peak MB":>8}'
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for stage in result["stages"]:
+            print(
+                f'{result["resources"]:>7} {stage["stage"]:<11} {stage["exit_code"]:>4} '
+                f'{stage["wall_seconds"]:>9.2f} {stage["process_spawns"]:>7} '
+                f'{stage["bytes_read"] / 1e6:>9.1f} {stage["bytes_written"] / 1e6:>9.1f} '
+                f'{stage["peak_rss_kb"] / 1024:>8.1f}'
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the import pipeline against fake terraformer/terraform binaries"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="100,1000,10000,50000",
+        help="comma separated numbers of synthetic resources per run",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds each terraformer call takes"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="fraction of terraformer calls that fail and have to be retried",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="run orchestrate.py, which migrates each resource type while other imports are running",
+    )
+    parser.add_argument(
+        "--orgs",
+        type=int,
+        default=0,
+        help="import this many orgs at once with orchestrate.py, sharing MAX_CONCURRENCY",
+    )
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the generated work directories"
+    )
+    args = parser.parse_args()
+
+    results = [
+        run_benchmark(
+            int(size),
+            args.latency,
+            args.failure_rate,
+            args.keep,
+            args.pipelined,
+            args.orgs,
+        )
+        for size in args.sizes.split(",")
+    ]
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from constants import TERRAFORM_DIR
+
+logger = logging.getLogger()
+
+
+def fingerprint(command, sections=None):
+    digest = hashlib.sha256(command.encode())
+    digest.update(json.dumps(sections, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ImportCache:
+    def __init__(self, cache_dir=None, ttl=None, refresh=()):
+        self.cache_dir = cache_dir or os.environ.get(
+            "IMPORT_CACHE_DIR", os.path.join(TERRAFORM_DIR, ".cache", "imports")
+        )
+        # ttl is given in hours; 0 disables the cache entirely
+        self.ttl = (
+            float(ttl if ttl is not None else os.environ.get("IMPORT_CACHE_TTL", 0))
+            * 3600
+        )
+        self.refresh = set(refresh)
+        self.hits, self.misses = 0, 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _entry(self, job):
+        return os.path.join(self.cache_dir, job["fingerprint"])
+
+    def _expired(self, entry):
+        try:
+            with open(os.path.join(entry, "meta.json"), "r") as meta:
+                created = json.load(meta)["created"]
+        except (FileNotFoundError, KeyError, json.JSONDecodeError):
+            return True
+        return time.time() - created > self.ttl
+
+    def evict(self):
+        if not self.enabled or not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if self._expired(entry):
+                logger.debug(f"Evicting expired import cache entry {name}")
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def restore(self, job):
+        if not self.enabled or not job.get("fingerprint"):
+            return False
+        if self.refresh & set(job["resources"].split(",")):
+            logger.info(f'[{job["name"]}] Refresh requested, skipping import cache')
+            self.misses += 1
+            return False
+        entry = self._entry(job)
+        if self._expired(entry):
+            self.misses += 1
+            return False
+        for index, output_dir in enumerate(job["output_dirs"]):
+            cached = os.path.join(entry, str(index))
+            if os.path.isdir(cached):
+                shutil.copytree(cached, output_dir, dirs_exist_ok=True)
+        logger.info(f'[{job["name"]}] Restored output from import cache')
+        self.hits += 1
+        return True
+
+    def store(self, job):
+        if not self.enabled or not job.get("fingerprint"):
+            return
+        entry = self._entry(job)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry)
+        for index, output_dir in enumerate(job["output_dirs"]):
+            if os.path.isdir(output_dir):
+                shutil.copytree(output_dir, os.path.join(entry, str(index)))
+        # meta.json is written last, so an interrupted store is treated as a miss
+        with open(os.path.join(entry, "meta.json"), "w") as meta:
+            json.dump({"created": time.time(), "job": job}, meta)
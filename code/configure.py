@@ -1,21 +1,31 @@
+import argparse
 import logging
 import os
-import subprocess
 import sys
 
+import journal
+import tracing
+from cache import ImportCache, fingerprint
+from delta import existing_ids, is_sharded, prune
 from constants import (
+    CONF_PATH,
+    DATADOG_DIR,
     HAS_COLONS,
     ID_MAP,
     LIST_RESOURCES,
     NESTED_RESOURCES,
     NO_ID_RESOURCES,
     OTHER_RESOURCES,
-    SUPPORTED_RESOURCES,
+    TERRAFORM_DIR,
+    TERRAFORMER_BIN,
 )
-from schema import SchemaError
-from validate_conf import config_schema
-from yaml import CLoader as Loader
-from yaml import load
+from plan import Plan, filter_size
+from process import ABORT_MARKERS, run_streaming
+from retry import RetryPolicy
+from scheduler import JobScheduler, SharedSlots
+from tracing import span
+from tuning import DEFAULT_FLAGS, Tuner
+from validate_conf import ConfigError, load_config
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
@@ -25,45 +35,112 @@ formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
+plan = Plan()
+# Terraformer calls are limited across every org imported at once
+slots = SharedSlots()
+# resource type -> IDs already in the merged state of an earlier run, for delta imports
+existing = {}
+
 
 def handle_list_resources(list_resources):
     for resource, conf in list_resources.items():
         # join() doesnt like integers
         conf = [str(c) for c in conf]
+        path, shard_dir = "{provider}/{service}", "shards"
+        if resource in existing:
+            # imported next to the existing files and merged into them by migrate.py
+            conf = missing_ids(resource, conf)
+            path, shard_dir = "{provider}/{service}/delta", ""
+        if not conf:
+            continue
         # strings with colons need to be wrapped in single quotes, otherwise they are treated
         # as an "and" type statement instead of something like an ARN value
         if resource in HAS_COLONS:
             conf = [f"'{c}'" for c in conf]
-        write_command(
-            "{provider}/{service}",
-            resource,
-            [f'--filter="Name={ID_MAP.get(resource, "id")};Value={":".join(conf)}"'],
-        )
+        write_id_commands(path, shard_dir, resource, conf)
+
+
+def missing_ids(resource, ids):
+    missing = [id for id in ids if id not in existing[resource]]
+    logger.info(
+        f"{len(ids) - len(missing)} of {len(ids)} configured {resource} IDs were imported before, importing {len(missing)}"
+    )
+    return missing
 
 
 def handle_no_id_resources(no_id):
     if no_id:
-        resources = list(set(no_id))
+        # sorted so the job, and with it its fingerprint, cache entry, journal entry
+        # and tuning history, is the same in every run
+        resources = sorted(set(no_id))
         write_command("{provider}/{service}", ",".join(resources))
 
 
 def handle_nested_resources(nested):
     for resource, confs in nested.items():
-        for conf in confs:
-            for conf_type, values in conf.items():
-                if conf_type == "ids":
-                    values = [str(v) for v in values]
-                    write_command(
-                        "{provider}/{service}/ids",
-                        resource,
-                        [
-                            f'--filter="Name={ID_MAP.get(resource, "id")};Value={":".join(values)}"'
-                        ],
-                    )
-                elif conf_type == "tags":
-                    tags_type(resource, values)
-                elif conf_type == "tagsets":
-                    tagsets(resource, values)
+        ids, selectors = collapse_selectors(resource, confs)
+        ids = [str(v) for v in ids]
+        if resource in existing:
+            ids = missing_ids(resource, ids)
+        if ids:
+            write_id_commands("{provider}/{service}/ids", "", resource, ids)
+        tags = [values for kind, _, values in selectors if kind == "tags"]
+        for i, values in enumerate(tags):
+            # several tags entries are imported side by side, like ID shards
+            path = "{provider}/{service}/tags" + (f"/{i:04d}" if len(tags) > 1 else "")
+            tags_type(resource, values, path)
+        for kind, set_name, values in selectors:
+            if kind == "tagsets":
+                tagset(resource, set_name, values)
+
+
+def collapse_selectors(resource, confs):
+    # merges every ids entry into one list and drops tag selectors that cannot add
+    # anything: tags are AND searches, so a selector whose tags include all the tags of
+    # another one only matches resources that the other one imports already
+    ids, seen = [], set()
+    selectors = []
+    for conf in confs:
+        for conf_type, values in conf.items():
+            if conf_type == "ids":
+                for value in values:
+                    if value not in seen:
+                        seen.add(value)
+                        ids.append(value)
+            elif conf_type == "tags":
+                selectors.append(("tags", "tags", normalize_tags(values)))
+            elif conf_type == "tagsets":
+                for entry in values:
+                    for set_name, sets in entry.items():
+                        selectors.append(("tagsets", set_name, normalize_tags(sets)))
+
+    kept = []
+    for kind, name, tags in selectors:
+        if not tags:
+            continue
+        covered = next((k for k in kept if set(k[2]) <= set(tags)), None)
+        if covered:
+            logger.info(
+                f'Skipping {resource} {kind} "{name}", its tags {list(tags)} are covered by {covered[0]} "{covered[1]}"'
+            )
+            continue
+        for k in [k for k in kept if set(tags) < set(k[2])]:
+            logger.info(
+                f'Skipping {resource} {k[0]} "{k[1]}", its tags {list(k[2])} are covered by {kind} "{name}"'
+            )
+            kept.remove(k)
+        kept.append((kind, name, tags))
+    return ids, kept
+
+
+def normalize_tags(values):
+    # Datadog stores tags in lowercase
+    tags = []
+    for value in values or []:
+        tag = value.strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tuple(tags)
 
 
 def handle_other_resources(resources):
@@ -113,62 +190,167 @@ def handle_slack_channel(resource, confs):
                         )
 
 
-def tags_type(resource, values):
+def tags_type(resource, values, path="{provider}/{service}/tags"):
     vals = [f"'{v}'" for v in values]
     write_command(
-        "{provider}/{service}/tags",
+        path,
         resource,
         [f'--filter="Name=tags;Value={":".join(vals)}"'],
     )
 
 
-def tagsets(resource, values):
-    for tagset in values:
-        for set_name, sets in tagset.items():
-            vals = [f"'{v}'" for v in sets]
+def tagset(resource, set_name, values):
+    vals = [f"'{v}'" for v in values]
+    write_command(
+        f"{{provider}}/{{service}}/tagsets/{set_name}",
+        resource,
+        [f'--filter="Name=tags;Value={":".join(vals)}"'],
+    )
+
+
+def write_id_commands(path, shard_dir, resource, ids):
+    # very long ID filters are split into shards that are imported as separate jobs
+    # into <path>/<shard_dir>/<shard>, and merged back together by migrate.py
+    shard_size = int(os.environ.get("ID_SHARD_SIZE", 500))
+    if len(ids) <= shard_size:
+        shards = {path: ids}
+    else:
+        shard_path = "/".join(p for p in (path, shard_dir) if p)
+        shards = {
+            f"{shard_path}/{i // shard_size:04d}": ids[i : i + shard_size]
+            for i in range(0, len(ids), shard_size)
+        }
+    for shard, values in shards.items():
         write_command(
-            f"{{provider}}/{{service}}/tagsets/{set_name}",
+            shard,
             resource,
-            [f'--filter="Name=tags;Value={":".join(vals)}"'],
+            [f'--filter="Name={ID_MAP.get(resource, "id")};Value={":".join(values)}"'],
         )
 
 
 def write_command(path, resource, filters=None):
-    base = "/usr/local/bin/terraformer import datadog"
-    if filters:
-        command = (
-            f'{base} -n 5 -m 1000 -p {path} --resources={resource} {" ".join(filters)}'
+    plan.add(path, resource, filters)
+
+
+def build_command(job):
+    flags = {**DEFAULT_FLAGS, **job.get("tuning", {})}
+    base = f'{TERRAFORMER_BIN} import datadog -n {flags["retry_number"]} -m {flags["retry_sleep_ms"]}'
+    command = f'{base} -p {job["path"]} --resources={job["resources"]}'
+    if job["filters"]:
+        command = f'{command} {" ".join(job["filters"])}'
+    return command
+
+
+def run_job(job, cache, policy):
+    step = f'import:{job.get("fingerprint", job["name"])}'
+    with span(
+        job["name"],
+        category="job",
+        resource_type=job["resources"],
+        filter_size=filter_size(job),
+    ) as attrs:
+        if journal.done(step):
+            logger.info(f'[{job["name"]}] Already imported, skipping')
+            attrs["resumed"] = True
+            return True
+        if cache.restore(job):
+            attrs["cached"] = True
+            journal.record(step, journal.DONE)
+            return True
+        succeeded = run_command(build_command(job), job["name"], policy)
+        attrs["retries"] = policy.stats.get(job["name"], {}).get("attempts", 1) - 1
+        if succeeded:
+            cache.store(job)
+            journal.record(step, journal.DONE)
+        return succeeded
+
+
+def submit_plan(plan, scheduler, cache, policy):
+    cache.evict()
+    for job in plan.jobs:
+        logger.debug(f"Scheduling the following command: {build_command(job)}")
+        scheduler.submit(job["name"], run_job, job, cache, policy)
+    return scheduler.jobs
+
+
+def report_plan(scheduler, cache, policy):
+    results = scheduler.summary()
+    policy.summary()
+    if cache.enabled:
+        logger.info(
+            f"Import cache: {cache.hits} jobs restored, {cache.misses} jobs imported"
         )
-    else:
-        command = f"{base} -n 5 -m 1000 -p {path} --resources={resource}"
-    logger.debug(f"Running the following command: {command}")
-    run_command(command)
+    return results
+
+
+def execute_plan(plan, scheduler, cache, policy):
+    submit_plan(plan, scheduler, cache, policy)
+    return report_plan(scheduler, cache, policy)
+
+
+def start_journal(resume, delta=False):
+    if not resume:
+        journal.reset()
+        if not os.environ.get("DD_ORG"):
+            # the trace of an orgs run is shared and reset once by orchestrate.py
+            tracing.reset()
+        if delta:
+            # tells migrate.py to add to the output of the earlier run instead of
+            # replacing it with the new imports
+            journal.record("delta", journal.DONE)
+        return
+    finished, unfinished = journal.summary()
+    logger.info(
+        f"Resuming previous run: {finished} steps finished, {unfinished} to complete or roll back"
+    )
 
 
-def run_command(command, retries=3):
-    output = subprocess.run(
-        command, shell=True, capture_output=True, cwd="/terraform", text=True
-    )
-    try:
-        # terraformer exits with code 0 on some failures; catch those to retry
-        if (
-            "error initializing resources in service" in output.stdout
-            or "Unable to refresh resource" in output.stdout
-            or "cannot assign requested address" in output.stdout
-        ):
-            raise Exception
-        output.check_returncode()
-        logger.info(output.stdout)
-    except:
-        if retries > 0:
-            logger.warn(
-                f'Command "{command}" failed with error {output.stdout}, {retries} retries left...retrying'
-            )
-            run_command(command, retries=retries - 1)
+def fingerprint_plan(plan, config):
+    sections = {
+        key: val
+        for resource_conf in config["resources"]
+        for key, val in resource_conf.items()
+    }
+    for job in plan.jobs:
+        if job["resources"] == "*":
+            job_sections = sections
         else:
-            logger.error(
-                f'Command "{command}" failed with error {output.stdout} - no retries left.'
+            job_sections = {
+                res: sections.get(res) for res in job["resources"].split(",")
+            }
+        # retry flags change between runs but not what is imported, so they are left
+        # out of the fingerprint
+        job["fingerprint"] = fingerprint(
+            build_command({**job, "tuning": {}}), job_sections
+        )
+
+
+def run_command(command, job_name, policy):
+    log_path = os.path.join(
+        os.environ.get("IMPORT_LOG_DIR", os.path.join(TERRAFORM_DIR, "logs")),
+        f'{job_name.replace("/", "_")}.log',
+    )
+    if os.path.exists(log_path):
+        os.remove(log_path)
+
+    def attempt():
+        with slots.hold(), span(
+            "terraformer", category="subprocess", job=job_name
+        ) as attrs:
+            returncode, tail, aborted = run_streaming(
+                command, log_path, cwd=TERRAFORM_DIR, abort_markers=ABORT_MARKERS
             )
+            attrs["returncode"] = returncode
+        if aborted:
+            logger.warning(f'[{job_name}] Aborted early after "{aborted}"')
+        return returncode, tail, "", bool(aborted)
+
+    succeeded = policy.execute(job_name, attempt)
+    if succeeded:
+        logger.info(f"[{job_name}] Completed, output written to {log_path}")
+    else:
+        logger.error(f"[{job_name}] Full output written to {log_path}")
+    return succeeded
 
 
 def filter_resources(no_ids, config, filter):
@@ -180,35 +362,71 @@ def filter_resources(no_ids, config, filter):
     }
 
 
-if __name__ == "__main__":
-    try:
-        with open("../conf.yaml", "r") as f:
-            config = load(f, Loader=Loader)
-    except FileNotFoundError:
-        raise FileNotFoundError('Could not find file "conf.yaml", ensure it is present')
-
-    if not config["resources"]:
-        logger.error(
-            'No resources were defined in conf.yaml, did you mean to add "all"? Exiting, please reconfigure.'
-        )
-        sys.exit(1)
-    try:
-        config_schema.validate(config)
-    except SchemaError as e:
-        raise Exception(e.code)
+def find_existing(config):
+    # with --delta, ID lists are compared against the output of the previous run;
+    # sharded output is left alone since new resources would have to be placed
+    # into the existing shards
+    resources = []
+    for resource_conf in config["resources"]:
+        entry = {}
+        for resource, conf in resource_conf.items():
+            if is_sharded(resource):
+                logger.warning(
+                    f"Skipping {resource}, delta imports do not support sharded output in {DATADOG_DIR}/{resource}"
+                )
+                continue
+            ids = existing_ids(resource)
+            if ids is not None:
+                existing[resource] = ids
+            entry[resource] = conf
+        if entry:
+            resources.append(entry)
+    return {**config, "resources": resources}
+
+
+def failed_types(plan, failed):
+    return {
+        resource
+        for job in plan.jobs
+        if job["name"] in failed
+        for resource in job["resources"].split(",")
+    }
 
-    config_resources = list(set().union(*(d.keys() for d in config["resources"])))
 
-    for res in config_resources:
-        if res not in SUPPORTED_RESOURCES:
-            logger.error(
-                f"Resource type '{res}' found in config, but it is not supported. It will not be imported."
-            )
+def prune_removed(config, skip=()):
+    # only types selected purely by ID can tell which resources were removed; runs
+    # after the imports, so a type whose import failed keeps what it had
+    for resource_conf in config["resources"]:
+        for resource, conf in resource_conf.items():
+            if resource not in existing or not conf:
+                continue
+            if resource in skip or "*" in skip:
+                logger.warning(
+                    f"Not pruning {resource}, not all of its imports succeeded"
+                )
+                continue
+            if resource in LIST_RESOURCES:
+                keep = conf
+            elif resource in NESTED_RESOURCES and all(
+                list(entry) == ["ids"] for entry in conf
+            ):
+                keep = [id for entry in conf for id in entry["ids"]]
+            else:
+                logger.info(f"Not pruning {resource}, it is not selected by IDs only")
+                continue
+            prune(resource, keep)
+
+
+def build_plan(config, delta=False):
+    if delta:
+        config = find_existing(config)
+    config_resources = list(set().union(*(d.keys() for d in config["resources"])))
 
     if "all" in config_resources:
         logger.info('Found "all" in configuration; importing all supported resources.')
-        write_command("--resources=*")
-        sys.exit(0)
+        write_command("{provider}/{service}", "*")
+        fingerprint_plan(plan, config)
+        return plan
 
     no_ids = [
         key
@@ -226,3 +444,94 @@ if __name__ == "__main__":
 
     other_resources = filter_resources(no_ids, config, OTHER_RESOURCES)
     handle_other_resources(other_resources)
+    fingerprint_plan(plan, config)
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import Datadog resources with Terraformer based on conf.yaml"
+    )
+    parser.add_argument(
+        "--plan-out",
+        help="write the import plan to this file and exit without running anything",
+    )
+    parser.add_argument(
+        "--manifest", help="execute a previously written plan instead of conf.yaml"
+    )
+    parser.add_argument(
+        "--only",
+        help="comma separated job names or resource types to run from the plan",
+    )
+    parser.add_argument(
+        "--refresh",
+        help="comma separated resource types to re-import even if a cached import exists",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the previous run, skipping the imports it finished",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="only import the configured IDs that are not in the output of the previous run",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="with --delta, remove resources whose IDs are no longer configured",
+    )
+    args = parser.parse_args()
+
+    if args.manifest:
+        plan = Plan.load(args.manifest)
+        tuner = Tuner()
+    else:
+        try:
+            config = load_config(CONF_PATH)
+        except ConfigError as e:
+            logger.error(f"Found {len(e.errors)} errors in conf.yaml:")
+            for error in e.errors:
+                logger.error(error)
+            sys.exit(1)
+
+        if "orgs" in config:
+            logger.error(
+                "conf.yaml defines orgs; run orchestrate.py, or set DD_ORG and TERRAFORM_DIR to import one of them"
+            )
+            sys.exit(1)
+
+        if not config["resources"]:
+            logger.error(
+                'No resources were defined in conf.yaml, did you mean to add "all"? Exiting, please reconfigure.'
+            )
+            sys.exit(1)
+
+        with span("build_plan"):
+            plan = build_plan(config, delta=args.delta)
+        tuner = Tuner(overrides=config.get("tuning"))
+
+    if args.only:
+        plan = plan.select(args.only.split(","))
+
+    tuner.apply(plan)
+    estimate = plan.estimate()
+    logger.info(
+        f'Plan contains {estimate["jobs"]} jobs filtering on {estimate["filter_values"]} values'
+    )
+
+    if args.plan_out:
+        plan.save(args.plan_out)
+        sys.exit(0)
+
+    start_journal(args.resume, delta=args.delta and not args.manifest)
+    cache = ImportCache(refresh=args.refresh.split(",") if args.refresh else ())
+    policy = RetryPolicy()
+    _, failed = execute_plan(plan, JobScheduler(), cache, policy)
+    tuner.record(plan, policy.stats)
+    tuner.save()
+    if args.delta and args.prune and not args.manifest:
+        prune_removed(config, skip=failed_types(plan, failed))
+    if failed:
+        sys.exit(1)
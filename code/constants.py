@@ -1,3 +1,10 @@
+import os
+
+TERRAFORM_DIR = os.environ.get("TERRAFORM_DIR", "/terraform")
+DATADOG_DIR = os.path.join(TERRAFORM_DIR, "datadog")
+CONF_PATH = os.environ.get("CONF_PATH", "../conf.yaml")
+TERRAFORMER_BIN = os.environ.get("TERRAFORMER_BIN", "/usr/local/bin/terraformer")
+
 LIST_RESOURCES = [
     "dashboard",
     "dashboard_list",
@@ -50,3 +57,45 @@ HAS_COLONS = [
     "tags",
     "tagsets",
 ]
+
+# types of the values each list resource accepts in conf.yaml
+LIST_VALUE_TYPES = {
+    "dashboard": (str,),
+    "dashboard_list": (int,),
+    "logs_archive": (str,),
+    "logs_custom_pipeline": (str,),
+    "logs_integration_pipeline": (str,),
+    "logs_index": (str,),
+    "integration_aws_lambda_arn": (str,),
+    "integration_aws_log_collection": (str, int),
+    "integration_azure": (str,),
+    "integration_pagerduty_service_object": (str,),
+    "metric_metadata": (str,),
+    "role": (str,),
+    "security_monitoring_default_rule": (str,),
+    "security_monitoring_rule": (str,),
+    "synthetics_global_variable": (str,),
+    "synthetics_private_location": (str,),
+    "user": (str,),
+}
+
+# list resources that cannot be left empty to import all of them
+REQUIRES_VALUES = [
+    "metric_metadata",
+    "security_monitoring_default_rule",
+    "security_monitoring_rule",
+    "synthetics_global_variable",
+    "synthetics_private_location",
+]
+
+NESTED_ID_TYPES = {
+    "monitor": (int,),
+    "service_level_objective": (str,),
+    "synthetics_test": (str,),
+}
+
+AWS_VALUE_TYPES = {
+    "aws_account_ids": (str, int),
+    "roles": (str,),
+    "account_role": (str,),
+}
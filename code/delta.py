@@ -0,0 +1,84 @@
+import logging
+import os
+import stat
+import tempfile
+
+from constants import DATADOG_DIR, ID_MAP
+from hcl import copy_blocks
+from tfstate import load_state, resource_address, write_state
+
+logger = logging.getLogger()
+
+
+def configured_id(resource_type, resource):
+    # the value conf.yaml lists a resource by; for the types in ID_MAP that is the
+    # attribute terraformer filters on rather than the resource's ID
+    instances = resource.get("instances") or [{}]
+    attributes = instances[0].get("attributes", {})
+    return str(attributes.get(ID_MAP.get(resource_type, "id")) or "")
+
+
+def existing_ids(resource_type):
+    # the configured IDs in the merged state an earlier run left behind, or None when
+    # there is no such state to add to
+    path = f"{DATADOG_DIR}/{resource_type}/terraform.tfstate"
+    if not os.path.exists(path):
+        return None
+    return {
+        configured_id(resource_type, res)
+        for res in load_state(path).get("resources", [])
+        if res.get("mode") != "data" and configured_id(resource_type, res)
+    }
+
+
+def is_sharded(resource_type):
+    # sharded output has a state per shard directory and none at the top level
+    type_dir = f"{DATADOG_DIR}/{resource_type}"
+    if not os.path.isdir(type_dir) or os.path.exists(f"{type_dir}/terraform.tfstate"):
+        return False
+    return any(
+        os.path.exists(f"{type_dir}/{name}/terraform.tfstate")
+        for name in os.listdir(type_dir)
+    )
+
+
+def prune(resource_type, keep_ids):
+    # removes the resources whose IDs are not in keep_ids from the merged state and
+    # its .tf file; both are replaced atomically and the .tf file first, so running
+    # it again after a crash finishes the job
+    state_path = f"{DATADOG_DIR}/{resource_type}/terraform.tfstate"
+    tf_path = f"{DATADOG_DIR}/{resource_type}/{resource_type}.tf"
+    if not os.path.exists(state_path):
+        return []
+    state = load_state(state_path)
+    keep_ids = {str(id) for id in keep_ids}
+    kept, removed = [], []
+    for res in state.get("resources", []):
+        # a resource without the attribute cannot be matched, so it is kept
+        id = configured_id(resource_type, res)
+        if res.get("mode") == "data" or not id or id in keep_ids:
+            kept.append(res)
+        else:
+            removed.append(resource_address(res))
+    if not removed:
+        return []
+
+    if os.path.exists(tf_path):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(tf_path), prefix=f".{resource_type}.tf.", suffix=".tmp"
+        )
+        os.close(fd)
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(tf_path).st_mode))
+            copy_blocks(tf_path, tmp_path, drop=removed)
+            os.replace(tmp_path, tf_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    state["resources"] = kept
+    state["serial"] = state.get("serial", 0) + 1
+    write_state(state_path, state)
+    logger.info(
+        f"Pruned {len(removed)} {resource_type} resources that are no longer in conf.yaml"
+    )
+    return removed
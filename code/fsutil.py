@@ -0,0 +1,72 @@
+import errno
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from collections import Counter
+
+logger = logging.getLogger()
+
+
+def atomic_write(path, data):
+    # write to a sibling temp file and rename over the original so a crash never
+    # leaves a half written file behind
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def move_entry(source, dest):
+    # rename is a metadata only operation on the same filesystem; across filesystems
+    # files are copied, since a hardlink cannot cross them either
+    try:
+        os.rename(source, dest)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    if os.path.isdir(source) and not os.path.islink(source):
+        os.makedirs(dest, exist_ok=True)
+        methods = Counter(
+            move_entry(os.path.join(source, name), os.path.join(dest, name))
+            for name in os.listdir(source)
+        )
+        os.rmdir(source)
+        return methods.most_common(1)[0][0] if methods else "rename"
+    shutil.copy2(source, dest)
+    os.remove(source)
+    return "copy"
+
+
+def promote(source, dest, methods=None):
+    # moves everything in source up into dest and removes source; directories that
+    # exist on both sides are merged, files in dest are replaced
+    methods = Counter() if methods is None else methods
+    for name in os.listdir(source):
+        src, dst = os.path.join(source, name), os.path.join(dest, name)
+        if os.path.lexists(dst):
+            if os.path.isdir(src) and os.path.isdir(dst):
+                promote(src, dst, methods)
+                continue
+            if os.path.isdir(src) or os.path.isdir(dst):
+                raise FileExistsError(
+                    f"Cannot move {src} to {dst}, one is a directory and the other is not"
+                )
+            logger.warning(f"{dst} already exists, replacing it with {src}")
+            os.remove(dst)
+        methods[move_entry(src, dst)] += 1
+    os.rmdir(source)
+    return methods
@@ -0,0 +1,117 @@
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger()
+
+Block = namedtuple("Block", ["type", "name", "start", "end"])
+
+RESOURCE_HEADER = re.compile(rb'^resource\s+"([^"]+)"\s+"([^"]+)"\s*\{')
+TOKENS = re.compile(rb'\\.|"|\{|\}|#|//|<<-?"?([A-Za-z_][A-Za-z0-9_]*)"?\s*$')
+CHUNK_SIZE = 1024 * 1024
+
+
+def _scan_line(line, depth):
+    # returns the brace depth after the line and the heredoc marker it opens, if any;
+    # braces inside strings and comments do not count
+    in_string = False
+    for token in TOKENS.finditer(line):
+        value = token.group(0)
+        if in_string:
+            in_string = value != b'"'
+        elif value == b'"':
+            in_string = True
+        elif value in (b"#", b"//"):
+            break
+        elif value == b"{":
+            depth += 1
+        elif value == b"}":
+            depth -= 1
+        elif token.group(1):
+            return depth, token.group(1)
+    return depth, None
+
+
+def index_blocks(path):
+    blocks = []
+    offset, depth, current, heredoc, in_comment = 0, 0, None, None, False
+    with open(path, "rb") as tf:
+        for line in tf:
+            stripped = line.strip()
+            if heredoc:
+                if stripped == heredoc:
+                    heredoc = None
+            elif in_comment:
+                in_comment = b"*/" not in line
+            elif stripped.startswith(b"/*"):
+                in_comment = b"*/" not in line
+            else:
+                if depth == 0 and (header := RESOURCE_HEADER.match(line)):
+                    current = (
+                        header.group(1).decode(),
+                        header.group(2).decode(),
+                        offset,
+                    )
+                depth, heredoc = _scan_line(line, depth)
+                if depth == 0 and current:
+                    blocks.append(Block(*current, offset + len(line)))
+                    current = None
+            offset += len(line)
+    if current:
+        logger.warning(
+            f'Unterminated resource block "{current[0]}.{current[1]}" in {path}'
+        )
+    return blocks
+
+
+def _copy_range(source, dest, start, end):
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        dest.write(chunk)
+        remaining -= len(chunk)
+
+
+def copy_blocks(source_path, dest_path, drop=()):
+    # appends source_path to dest_path in one pass, leaving out the resource blocks
+    # whose "type.name" address is in drop
+    drop = set(drop)
+    skipped = [
+        block
+        for block in index_blocks(source_path)
+        if f"{block.type}.{block.name}" in drop
+    ]
+    size = os.path.getsize(source_path)
+    position = 0
+    with open(source_path, "rb") as source, open(dest_path, "ab") as dest:
+        for block in skipped:
+            _copy_range(source, dest, position, block.start)
+            position = block.end
+        _copy_range(source, dest, position, size)
+    return [f"{block.type}.{block.name}" for block in skipped]
+
+
+def split_blocks(source_path, dest_path):
+    # copies every resource block of source_path to the file dest_path returns for its
+    # "type.name" address, in one pass, replacing what those files held before; returns
+    # the number of blocks per file
+    counts = {}
+    outputs = {}
+    try:
+        with open(source_path, "rb") as source:
+            for block in index_blocks(source_path):
+                path = dest_path(f"{block.type}.{block.name}")
+                if path not in outputs:
+                    outputs[path] = open(path, "wb")
+                    counts[path] = 0
+                _copy_range(source, outputs[path], block.start, block.end)
+                outputs[path].write(b"\n")
+                counts[path] += 1
+    finally:
+        for output in outputs.values():
+            output.close()
+    return counts
@@ -0,0 +1,171 @@
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import sys
+
+from constants import DATADOG_DIR, TERRAFORM_DIR
+from hcl import index_blocks
+from tfstate import load_state, resource_address, resource_id
+from tracing import span
+
+logger = logging.getLogger()
+
+INVENTORY_FILE = os.environ.get(
+    "INVENTORY_FILE", os.path.join(TERRAFORM_DIR, "inventory.db")
+)
+COLUMNS = [
+    "address",
+    "datadog_id",
+    "resource_type",
+    "tf_file",
+    "byte_offset",
+    "byte_length",
+    "state_file",
+]
+SCHEMA = """
+CREATE TABLE resources (
+    address TEXT NOT NULL,
+    datadog_id TEXT,
+    resource_type TEXT NOT NULL,
+    tf_file TEXT,
+    byte_offset INTEGER,
+    byte_length INTEGER,
+    state_file TEXT NOT NULL,
+    PRIMARY KEY (state_file, address)
+);
+CREATE INDEX resources_address ON resources (address);
+CREATE INDEX resources_datadog_id ON resources (datadog_id);
+CREATE INDEX resources_type ON resources (resource_type);
+"""
+
+
+def state_rows(root, state_path):
+    # one row per resource of the state, located in the .tf files next to it; paths are
+    # stored relative to root so the tree can be moved along with the inventory
+    state_dir = os.path.dirname(state_path)
+    blocks = {}
+    for tf_path in sorted(glob.glob(os.path.join(state_dir, "*.tf"))):
+        for block in index_blocks(tf_path):
+            blocks[f"{block.type}.{block.name}"] = (
+                os.path.relpath(tf_path, root),
+                block.start,
+                block.end - block.start,
+            )
+    for res in load_state(state_path).get("resources", []):
+        address = resource_address(res)
+        tf_file, offset, length = blocks.get(address, (None, None, None))
+        yield (
+            address,
+            resource_id(res) or None,
+            res["type"],
+            tf_file,
+            offset,
+            length,
+            os.path.relpath(state_path, root),
+        )
+
+
+def build_inventory(root=DATADOG_DIR, path=INVENTORY_FILE):
+    # written to a temporary database and moved into place, so readers never see a
+    # partially built inventory
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with span("build_inventory", root=root) as attrs:
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.executescript(SCHEMA)
+            count = 0
+            for dirpath, _, filenames in os.walk(root):
+                if "terraform.tfstate" not in filenames:
+                    continue
+                rows = list(
+                    state_rows(root, os.path.join(dirpath, "terraform.tfstate"))
+                )
+                db.executemany(
+                    f"INSERT OR REPLACE INTO resources VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows,
+                )
+                count += len(rows)
+            db.commit()
+        finally:
+            db.close()
+        os.replace(tmp_path, path)
+        attrs["resources"] = count
+    logger.info(f"Wrote inventory of {count} resources to {path}")
+    return count
+
+
+def lookup(path=INVENTORY_FILE, address=None, datadog_id=None, resource_type=None):
+    conditions = {
+        "address": address,
+        "datadog_id": datadog_id,
+        "resource_type": resource_type,
+    }
+    conditions = {column: value for column, value in conditions.items() if value}
+    where = " AND ".join(f"{column} = ?" for column in conditions) or "1"
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM resources WHERE {where} ORDER BY state_file, address",
+            list(conditions.values()),
+        ).fetchall()
+    finally:
+        db.close()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def read_block(root, row):
+    with open(os.path.join(root, row["tf_file"]), "rb") as tf:
+        tf.seek(row["byte_offset"])
+        return tf.read(row["byte_length"]).decode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Look up imported resources in the inventory written by migrate.py"
+    )
+    parser.add_argument("--id", help="Datadog ID, such as a monitor ID")
+    parser.add_argument(
+        "--address", help="Terraform address, such as datadog_monitor.foo"
+    )
+    parser.add_argument(
+        "--type", help="Terraform resource type, such as datadog_monitor"
+    )
+    parser.add_argument(
+        "--show", action="store_true", help="print the Terraform block of each match"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the inventory from the files under the datadog directory first",
+    )
+    parser.add_argument("--root", default=DATADOG_DIR, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logger.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    ch = logging.StreamHandler()
+    ch.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    if args.rebuild:
+        build_inventory(args.root)
+    if not os.path.exists(INVENTORY_FILE):
+        sys.exit(f"No inventory found at {INVENTORY_FILE}, run migrate.py or --rebuild")
+
+    rows = lookup(address=args.address, datadog_id=args.id, resource_type=args.type)
+    for row in rows:
+        location = (
+            f'{row["tf_file"]}:{row["byte_offset"]}+{row["byte_length"]}'
+            if row["tf_file"]
+            else "-"
+        )
+        print(f'{row["address"]}\t{row["datadog_id"]}\t{location}\t{row["state_file"]}')
+        if args.show and row["tf_file"]:
+            print(read_block(args.root, row))
+    if not rows:
+        sys.exit(1)
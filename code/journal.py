@@ -0,0 +1,81 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from constants import TERRAFORM_DIR
+
+logger = logging.getLogger()
+
+# every completed import job and migrate step is appended to the journal, so a run that
+# stopped halfway can be resumed; configure.py and orchestrate.py start a new journal
+# unless they are given --resume, and every process of a run appends to the same file
+JOURNAL_FILE = os.environ.get(
+    "RUN_JOURNAL", os.path.join(TERRAFORM_DIR, ".journal.jsonl")
+)
+STARTED = "started"
+DONE = "done"
+
+_entries = None
+_lock = threading.Lock()
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        _entries = {}
+        try:
+            with open(JOURNAL_FILE, "r") as journal:
+                for line in journal:
+                    try:
+                        step = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may have been cut off when the run stopped
+                        continue
+                    _entries[step["step"]] = step
+        except FileNotFoundError:
+            pass
+    return _entries
+
+
+def reset():
+    global _entries
+    with _lock:
+        os.makedirs(os.path.dirname(JOURNAL_FILE), exist_ok=True)
+        open(JOURNAL_FILE, "w").close()
+        _entries = {}
+
+
+def entry(step):
+    with _lock:
+        return _load().get(step)
+
+
+def done(step):
+    record = entry(step)
+    return record is not None and record["status"] == DONE
+
+
+def record(step, status, **data):
+    step_record = {"step": step, "status": status, "time": time.time(), **data}
+    line = json.dumps(step_record) + "\n"
+    with _lock:
+        _load()[step] = step_record
+        os.makedirs(os.path.dirname(JOURNAL_FILE), exist_ok=True)
+        with open(JOURNAL_FILE, "a") as journal:
+            fcntl.flock(journal, fcntl.LOCK_EX)
+            journal.write(line)
+            journal.flush()
+            os.fsync(journal.fileno())
+    logger.debug(f"Journal: {step} {status}")
+    return step_record
+
+
+def summary():
+    # returns the number of finished and unfinished steps
+    with _lock:
+        statuses = [step["status"] for step in _load().values()]
+    finished = statuses.count(DONE)
+    return finished, len(statuses) - finished
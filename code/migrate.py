@@ -1,105 +1,122 @@
-import glob
-import json
+import fcntl
 import logging
+import multiprocessing
 import os
-import re
 import shutil
-import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
 
-from constants import NESTED_RESOURCES, OTHER_RESOURCES
-from yaml import CLoader as Loader
-from yaml import load
+import journal
+import tracing
+
+from constants import (
+    CONF_PATH,
+    DATADOG_DIR,
+    LIST_RESOURCES,
+    NESTED_RESOURCES,
+    OTHER_RESOURCES,
+    TERRAFORM_DIR,
+)
+from fsutil import promote
+from hcl import copy_blocks
+from inventory import build_inventory
+from postprocess import run_pipeline
+from shard import shard_resource_type
+from tfstate import find_duplicates, merge_state, state_serial
+from tracing import span
+from validate_conf import load_config
 
 logger = logging.getLogger()
-logger.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
-ch = logging.StreamHandler()
-ch.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
-
-def state_move(resource_type, res_dir):
-    tf_resources = (
-        subprocess.check_output(
-            [
-                "terraform",
-                "state",
-                "list",
-                f"-state=/terraform/datadog/{resource_type}/{res_dir}/terraform.tfstate",
-            ],
-            text=True,
-        )
-        .strip()
-        .split("\n")
+# orchestrate.py imports this module after configure.py has already set up logging
+if not logger.handlers:
+    logger.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    ch = logging.StreamHandler()
+    ch.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
-    for res in tf_resources:
-        if res:
-            logger.debug(
-                f"Moving {res} from /terraform/datadog/{resource_type}/{res_dir}/terraform.tfstate to /terraform/datadog/{resource_type}/terraform.tfstate"
-            )
-            try:
-                result = subprocess.run(
-                    [
-                        "terraform",
-                        "state",
-                        "mv",
-                        f"-state=/terraform/datadog/{resource_type}/{res_dir}/terraform.tfstate",
-                        f"-state-out=/terraform/datadog/{resource_type}/terraform.tfstate",
-                        f"{res}",
-                        f"{res}",
-                    ],
-                    capture_output=True,
-                    text=True,
-                )
-                result.check_returncode()
-                logger.info(result.stdout)
-            except Exception:
-                if "Invalid target address" in result.stderr:
-                    logger.warn(
-                        f"Duplicate resource {res} found, removing from TF file"
-                    )
-                    remove_tf_resource(resource_type, res_dir, res)
-                else:
-                    logger.error(result.stderr)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
 
 
-def remove_tf_resource(resource_type, resource_dir, resource_name):
-    tf_res_type, tf_res_name = resource_name.split(".")
-    regex = f'(resource "{tf_res_type}" "{tf_res_name}" \{{\n .*?\n\}})'
-    with open(
-        f"/terraform/datadog/{resource_type}/{resource_dir}/{resource_type}.tf", "r"
-    ) as tf:
-        logger.debug(
-            f'Removing {tf_res_name} from "/terraform/datadog/{resource_type}/{resource_dir}/{resource_type}.tf"'
+def state_move(resource_type, res_dir, drop=()):
+    source = f"{DATADOG_DIR}/{resource_type}/{res_dir}/terraform.tfstate"
+    dest = f"{DATADOG_DIR}/{resource_type}/terraform.tfstate"
+    step = f"state_move:{resource_type}/{res_dir}"
+    entry = journal.entry(step)
+    if entry and (
+        entry["status"] == journal.DONE or state_serial(dest) == entry["serial"]
+    ):
+        # merged before the run stopped; the destination serial shows whether a
+        # merge that was started got written
+        if entry["status"] != journal.DONE:
+            journal.record(step, journal.DONE, conflicts=entry["conflicts"])
+        logger.debug(f"Resources from {source} were already moved to {dest}")
+        return entry["conflicts"]
+
+    logger.debug(f"Moving resources from {source} to {dest}")
+    with span("state_move", resource_type=resource_type, res_dir=res_dir) as attrs:
+        moved, conflicts = merge_state(
+            source,
+            dest,
+            before_write=lambda serial, conflicts: journal.record(
+                step, journal.STARTED, serial=serial, conflicts=list(drop) + conflicts
+            ),
+            drop=drop,
         )
-        tf_file = tf.read()
-    with open(
-        f"/terraform/datadog/{resource_type}/{resource_dir}/{resource_type}.tf", "w"
-    ) as tf:
-        tf.write(re.sub(regex, "", tf_file, flags=re.DOTALL))
+        attrs.update(moved=len(moved), conflicts=len(conflicts), dropped=len(drop))
+        conflicts = list(drop) + conflicts
+    journal.record(step, journal.DONE, conflicts=conflicts)
+    logger.info(f"Moved {len(moved)} resources from {source} to {dest}")
+    for res in conflicts:
+        logger.warn(f"Duplicate resource {res} found, removing from TF file")
+    return conflicts
 
 
-def combine_tf_files(resource_type, res_dir):
-    if os.path.exists(
-        f"/terraform/datadog/{resource_type}/{res_dir}/{resource_type}.tf"
-    ):
+def combine_tf_files(resource_type, res_dir, duplicates=()):
+    step = f"combine_tf_files:{resource_type}/{res_dir}"
+    entry = journal.entry(step)
+    if entry and entry["status"] == journal.DONE:
+        return
+    dest = f"{DATADOG_DIR}/{resource_type}/{resource_type}.tf"
+    if entry:
+        # drop whatever part of the file was appended before the run stopped; it may
+        # not have been created yet, in which case there is nothing to roll back
+        if os.path.exists(dest):
+            logger.info(f"Rolling back partial append to {dest}")
+            os.truncate(dest, entry["size"])
+    else:
+        size = os.path.getsize(dest) if os.path.exists(dest) else 0
+        journal.record(step, journal.STARTED, size=size)
+    if os.path.exists(f"{DATADOG_DIR}/{resource_type}/{res_dir}/{resource_type}.tf"):
         logger.info(
-            f"Combining /terraform/datadog/{resource_type}/{res_dir}/{resource_type}.tf with /terraform/datadog/{resource_type}/{resource_type}.tf"
-        )
-        subprocess.run(
-            [
-                f"cat /terraform/datadog/{resource_type}/{res_dir}/{resource_type}.tf >> /terraform/datadog/{resource_type}/{resource_type}.tf"
-            ],
-            shell=True,
+            f"Combining {DATADOG_DIR}/{resource_type}/{res_dir}/{resource_type}.tf with {DATADOG_DIR}/{resource_type}/{resource_type}.tf"
         )
+        with span(
+            "combine_tf_files",
+            resource_type=resource_type,
+            res_dir=res_dir,
+            duplicates=len(duplicates),
+        ):
+            removed = copy_blocks(
+                f"{DATADOG_DIR}/{resource_type}/{res_dir}/{resource_type}.tf",
+                f"{DATADOG_DIR}/{resource_type}/{resource_type}.tf",
+                drop=duplicates,
+            )
+        for res in set(duplicates) - set(removed):
+            logger.warn(
+                f"Duplicate resource {res} not found in {DATADOG_DIR}/{resource_type}/{res_dir}/{resource_type}.tf"
+            )
+    journal.record(step, journal.DONE)
 
 
 def check_path_exists(resources):
     output = {}
     for res_type, res_paths in resources.items():
         for res_path in res_paths:
-            if os.path.exists(f"/terraform/datadog/{res_type}/{res_path}"):
+            if os.path.exists(f"{DATADOG_DIR}/{res_type}/{res_path}"):
                 if res_type in output:
                     output[res_type].append(res_path)
                 else:
@@ -108,10 +125,19 @@ def check_path_exists(resources):
 
 
 def copy_and_del(source, dest):
-    logger.debug(f"Copying {source} to {dest}")
-    shutil.copytree(source, dest, dirs_exist_ok=True)
-    logger.debug(f"Deleting {source}")
-    shutil.rmtree(source)
+    # promote only moves what is left in source, so an interrupted move is completed
+    # by running it again
+    step = f"copy_and_del:{os.path.normpath(source)}"
+    if journal.done(step):
+        return
+    if not journal.entry(step):
+        journal.record(step, journal.STARTED)
+    logger.debug(f"Moving {source} to {dest}")
+    with span("copy_and_del", source=source, dest=dest) as attrs:
+        methods = promote(source, dest) if os.path.exists(source) else {}
+        attrs.update(methods)
+    journal.record(step, journal.DONE)
+    logger.debug(f"Moved {source} to {dest}: {dict(methods)}")
 
 
 def sort_config(config):
@@ -128,20 +154,35 @@ def sort_config(config):
     return sorted_conf
 
 
-def process_tagset_init(res_type, key):
-    dirs = os.listdir(f"/terraform/datadog/{res_type}/{key}")
-    file_destination_source = f"/terraform/datadog/{res_type}/{key}/{dirs.pop(0)}/"
-    copy_and_del(file_destination_source, f"/terraform/datadog/{res_type}")
-    for dir in dirs:
-        state_move(res_type, f"{key}/{dir}")
-        combine_tf_files(res_type, f"{key}/{dir}")
-    shutil.rmtree(f"/terraform/datadog/{res_type}/{key}/")
+def has_sub_imports(res_type, res_dir):
+    # tagsets, slack accounts and sharded ID lists hold one import per sub-directory
+    # instead of a single import of their own
+    return not os.path.exists(f"{DATADOG_DIR}/{res_type}/{res_dir}/terraform.tfstate")
 
 
-if __name__ == "__main__":
-    with open("../conf.yaml", "r") as f:
-        config = load(f, Loader=Loader)
+def process_tagset_init(res_type, key, duplicates=None):
+    step = f"process_tagset_init:{res_type}/{key}"
+    entry = journal.entry(step)
+    if entry and entry["status"] == journal.DONE:
+        return
+    if entry:
+        # the first directory may already have been promoted, so use the listing
+        # taken when the step started
+        dirs = list(entry["dirs"])
+    else:
+        dirs = sorted(os.listdir(f"{DATADOG_DIR}/{res_type}/{key}"))
+        journal.record(step, journal.STARTED, dirs=dirs)
+    file_destination_source = f"{DATADOG_DIR}/{res_type}/{key}/{dirs.pop(0)}/"
+    copy_and_del(file_destination_source, f"{DATADOG_DIR}/{res_type}")
+    for dir in dirs:
+        drop = (duplicates or {}).get(f"{key}/{dir}", ())
+        removed = state_move(res_type, f"{key}/{dir}", drop)
+        combine_tf_files(res_type, f"{key}/{dir}", removed)
+    shutil.rmtree(f"{DATADOG_DIR}/{res_type}/{key}/", ignore_errors=True)
+    journal.record(step, journal.DONE)
+
 
+def migration_dirs(config):
     migratable = NESTED_RESOURCES + OTHER_RESOURCES
 
     to_migrate = {
@@ -154,69 +195,262 @@ if __name__ == "__main__":
     tf_directories = sort_config(
         check_path_exists(
             {
-                resource_type: [
-                    conf_key for conf in configs for conf_key, _ in conf.items()
-                ]
+                # a key such as ids can appear in more than one entry
+                resource_type: list(
+                    dict.fromkeys(conf_key for conf in configs for conf_key in conf)
+                )
                 for resource_type, configs in to_migrate.items()
             }
         )
     )
 
-    for resource_type in tf_directories.keys():
-        if len(resource_dir := tf_directories.get(resource_type)) == 1:
-            if "tagsets" in resource_dir:
-                process_tagset_init(resource_type, "tagsets")
+    # ID lists are imported straight into the type directory unless they were split
+    # into shards or only add to the output of an earlier run
+    for resource_type in LIST_RESOURCES:
+        for res_dir in ("shards", "delta"):
+            if os.path.exists(f"{DATADOG_DIR}/{resource_type}/{res_dir}"):
+                tf_directories[resource_type] = [res_dir]
+
+    # sharded types are split up even when there is nothing to merge
+    for resource_type in config.get("shards", {}):
+        if os.path.exists(f"{DATADOG_DIR}/{resource_type}"):
+            tf_directories.setdefault(resource_type, [])
+    return tf_directories
+
+
+def migrate_resource_type(resource_type, resource_dirs, config):
+    # each resource type only touches its own directory, so types can be migrated in
+    # parallel; the lock guards against two workers ever merging the same state
+    os.makedirs(f"{TERRAFORM_DIR}/.locks", exist_ok=True)
+    with open(f"{TERRAFORM_DIR}/.locks/{resource_type}.lock", "w") as lock, span(
+        "migrate_resource_type", resource_type=resource_type
+    ):
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        step = f"migrate_resource_type:{resource_type}"
+        entry = journal.entry(step)
+        if not entry or entry["status"] != journal.DONE:
+            if entry:
+                # directories that were merged and removed before the run stopped
+                # still decide which one was promoted first
+                resource_dirs = entry["dirs"]
+                into_existing = entry.get("into_existing", False)
             else:
-                copy_and_del(
-                    f"/terraform/datadog/{resource_type}/{resource_dir[0]}/",
-                    f"/terraform/datadog/{resource_type}",
+                # a delta run adds to the state an earlier run left; otherwise the
+                # first import replaces it, as the earlier output is out of date
+                into_existing = journal.done("delta") and os.path.exists(
+                    f"{DATADOG_DIR}/{resource_type}/terraform.tfstate"
+                )
+                journal.record(
+                    step,
+                    journal.STARTED,
+                    dirs=list(resource_dirs),
+                    into_existing=into_existing,
                 )
+            merge_resource_dirs(resource_type, list(resource_dirs), into_existing)
+            journal.record(step, journal.DONE)
+        layout = config.get("shards", {}).get(resource_type)
+        if layout:
+            shard_step(resource_type, layout, config)
+    return resource_type
+
+
+def merge_order(resource_type, resource_dirs):
+    # the directories holding a state, in the order they are merged
+    order = []
+    for res_dir in resource_dirs:
+        path = f"{DATADOG_DIR}/{resource_type}/{res_dir}"
+        if os.path.exists(f"{path}/terraform.tfstate"):
+            order.append(res_dir)
+        elif os.path.isdir(path):
+            order.extend(
+                f"{res_dir}/{dir}"
+                for dir in sorted(os.listdir(path))
+                if os.path.exists(f"{path}/{dir}/terraform.tfstate")
+            )
+    return order
+
+
+def first_promoted(resource_type, first_dir):
+    # whether a run that stopped already promoted the state of the first import
+    # directory, tagsets included, into the type directory
+    path = f"{DATADOG_DIR}/{resource_type}/{first_dir}"
+    entry = journal.entry(f"process_tagset_init:{resource_type}/{first_dir}")
+    if entry and entry["status"] == journal.DONE:
+        return True
+    if entry:
+        path = f'{path}/{entry["dirs"][0]}'
+    return bool(
+        journal.entry(f"copy_and_del:{os.path.normpath(path)}")
+    ) and not os.path.exists(f"{path}/terraform.tfstate")
+
+
+def index_duplicates(resource_type, resource_dirs, include_dest=False):
+    # every state is indexed before anything moves, so duplicates between any of the
+    # import directories are known up front; the type-level state only comes first
+    # when it belongs to this run, otherwise it is about to be replaced
+    order = ([""] if include_dest else []) + merge_order(resource_type, resource_dirs)
+    paths = {
+        os.path.normpath(
+            f"{DATADOG_DIR}/{resource_type}/{res_dir}/terraform.tfstate"
+        ): res_dir
+        for res_dir in order
+    }
+    with span(
+        "index_duplicates", resource_type=resource_type, states=len(paths)
+    ) as attrs:
+        duplicates = find_duplicates(list(paths))
+        attrs["duplicates"] = sum(len(addresses) for addresses in duplicates.values())
+    if duplicates:
+        logger.info(
+            f'Found {attrs["duplicates"]} duplicate {resource_type} resources across {len(paths)} states'
+        )
+    return {paths[path]: addresses for path, addresses in duplicates.items()}
+
+
+def merge_resource_dirs(resource_type, resource_dirs, into_existing=False):
+    if not resource_dirs:
+        return
+    duplicates = index_duplicates(
+        resource_type,
+        resource_dirs,
+        into_existing or first_promoted(resource_type, resource_dirs[0]),
+    )
+    if not into_existing:
+        first_dir = resource_dirs.pop(0)
+        first_path = f"{DATADOG_DIR}/{resource_type}/{first_dir}"
+        if journal.entry(
+            f"copy_and_del:{os.path.normpath(first_path)}"
+        ) or not has_sub_imports(resource_type, first_dir):
+            copy_and_del(f"{first_path}/", f"{DATADOG_DIR}/{resource_type}")
         else:
-            resource_dirs = tf_directories.get(resource_type)
-            if resource_type == "integration_slack_channel":
-                process_tagset_init(resource_type, resource_dirs.pop(0))
+            process_tagset_init(resource_type, first_dir, duplicates)
+    for res_dir in resource_dirs:
+        step = f"merge:{resource_type}/{res_dir}"
+        if not journal.done(step):
+            if has_sub_imports(resource_type, res_dir):
+                dirs = sorted(os.listdir(f"{DATADOG_DIR}/{resource_type}/{res_dir}"))
+                for dir in dirs:
+                    removed = state_move(
+                        resource_type,
+                        f"{res_dir}/{dir}",
+                        duplicates.get(f"{res_dir}/{dir}", ()),
+                    )
+                    combine_tf_files(resource_type, f"{res_dir}/{dir}", removed)
+                    shutil.rmtree(f"{DATADOG_DIR}/{resource_type}/{res_dir}/{dir}")
             else:
-                file_destination_source = (
-                    f"/terraform/datadog/{resource_type}/{resource_dirs.pop(0)}/"
+                removed = state_move(
+                    resource_type, res_dir, duplicates.get(res_dir, ())
                 )
+                combine_tf_files(resource_type, res_dir, removed)
+            journal.record(step, journal.DONE)
+        shutil.rmtree(f"{DATADOG_DIR}/{resource_type}/{res_dir}/", ignore_errors=True)
 
-                copy_and_del(
-                    file_destination_source, f"/terraform/datadog/{resource_type}"
-                )
-            for res_dir in resource_dirs:
-                if res_dir == "tagsets" or "slack" in res_dir:
-                    dirs = os.listdir(f"/terraform/datadog/{resource_type}/{res_dir}")
-                    for dir in dirs:
-                        state_move(resource_type, f"{res_dir}/{dir}")
-                        combine_tf_files(resource_type, f"{res_dir}/{dir}")
-                        shutil.rmtree(
-                            f"/terraform/datadog/{resource_type}/{res_dir}/{dir}"
-                        )
-                else:
-                    state_move(resource_type, res_dir)
-                    combine_tf_files(resource_type, res_dir)
-                shutil.rmtree(f"/terraform/datadog/{resource_type}/{res_dir}/")
-
-    for f in glob.glob("/terraform/datadog/**/terraform.tfstate"):
-        with open(f, "r") as tfstate:
-            tf_json = json.load(tfstate)
-        tf_json["outputs"] = {}
-        with open(f, "w") as tfstate:
-            json.dump(tf_json, tfstate, indent=4)
-
-    for f in glob.glob("/terraform/datadog/**/outputs.tf"):
-        os.remove(f)
-
-    for f in glob.glob("/terraform/datadog/**/provider.tf"):
-        with open(f, "w") as provider:
-            provider.write(
-                """
-terraform {
-    required_providers {
-        datadog = {
-            source = "DataDog/datadog"
-            version = "= 3.34.0"
+
+def shard_step(resource_type, layout, config):
+    step = f"shard_resource_type:{resource_type}"
+    entry = journal.entry(step)
+    if entry and entry["status"] == journal.DONE:
+        return
+    type_dir = f"{DATADOG_DIR}/{resource_type}"
+    if entry and not os.path.exists(f"{type_dir}/terraform.tfstate"):
+        # the merged state is removed last, so once it is gone only leftovers remain
+        for name in os.listdir(type_dir):
+            if os.path.isfile(f"{type_dir}/{name}"):
+                os.remove(f"{type_dir}/{name}")
+        journal.record(step, journal.DONE)
+        return
+    if not entry:
+        journal.record(step, journal.STARTED)
+    # while the merged state exists, shard directories are either incomplete or left
+    # by an earlier run, and are rebuilt from the merged state
+    if os.path.exists(f"{type_dir}/terraform.tfstate"):
+        for name in os.listdir(type_dir):
+            if os.path.isdir(f"{type_dir}/{name}"):
+                shutil.rmtree(f"{type_dir}/{name}")
+    shard_resource_type(resource_type, layout, config)
+    journal.record(step, journal.DONE)
+
+
+def post_process():
+    # every transform gives the same result when run again, so an interrupted pass is
+    # simply repeated
+    if not journal.done("post_process"):
+        run_pipeline(DATADOG_DIR)
+        journal.record("post_process", journal.DONE)
+    # the inventory is rebuilt from the final files, so it needs no journal entry
+    build_inventory(DATADOG_DIR)
+
+
+def init_worker(log_queue):
+    # workers send their log records to the parent process, which writes them out
+    # through its own handlers so output from different types is not interleaved mid-line
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+
+
+def run_worker(resource_type, resource_dirs, config):
+    try:
+        return migrate_resource_type(resource_type, resource_dirs, config)
+    finally:
+        # pool workers exit without running atexit hooks
+        tracing.flush()
+
+
+@contextmanager
+def migration_pool(max_workers=None):
+    # workers are started from a fork server because the caller may already be running
+    # import threads and the log listener, and forking a threaded process is unsafe
+    context = multiprocessing.get_context("forkserver")
+    log_queue = context.Manager().Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(log_queue,),
+        ) as executor:
+            yield executor
+    finally:
+        listener.stop()
+
+
+def migrate_all(tf_directories, config, max_workers=None):
+    failed = []
+    if not tf_directories:
+        return failed
+    with migration_pool(
+        max_workers or min(len(tf_directories), os.cpu_count())
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_worker, resource_type, resource_dirs, config
+            ): resource_type
+            for resource_type, resource_dirs in tf_directories.items()
         }
-    }
-}"""
-            )
+        for future in as_completed(futures):
+            try:
+                logger.info(f"Finished migrating {future.result()}")
+            except Exception as e:
+                logger.error(f"Migrating {futures[future]} failed: {e!r}")
+                failed.append(futures[future])
+    return failed
+
+
+if __name__ == "__main__":
+    config = load_config(CONF_PATH)
+    if "orgs" in config:
+        logger.error(
+            "conf.yaml defines orgs; run orchestrate.py, or set DD_ORG and TERRAFORM_DIR to migrate one of them"
+        )
+        sys.exit(1)
+
+    failed = migrate_all(migration_dirs(config), config)
+
+    post_process()
+
+    if failed:
+        sys.exit(1)
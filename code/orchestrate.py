@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import tracing
+from cache import ImportCache
+from configure import (
+    build_plan,
+    failed_types,
+    prune_removed,
+    report_plan,
+    start_journal,
+    submit_plan,
+)
+from constants import CONF_PATH
+from migrate import migration_dirs, migration_pool, post_process, run_worker
+from orgs import run_orgs
+from retry import RetryPolicy
+from scheduler import JobScheduler
+from tracing import span
+from tuning import Tuner
+from validate_conf import ConfigError, load_config
+
+logger = logging.getLogger()
+
+
+async def migrate_when_imported(resource_type, imports, config, executor):
+    # imports is every job writing into the resource type's directory; once they have
+    # all finished, nothing else touches it and it can be migrated while other types
+    # are still importing
+    await asyncio.gather(*imports, return_exceptions=True)
+    resource_dirs = migration_dirs(config).get(resource_type)
+    if resource_dirs is None:
+        return None
+    logger.info(f"All imports for {resource_type} finished, starting migration")
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            executor, run_worker, resource_type, resource_dirs, config
+        )
+    except Exception as e:
+        logger.error(f"Migrating {resource_type} failed: {e!r}")
+        return resource_type
+    logger.info(f"Finished migrating {resource_type}")
+    return None
+
+
+async def orchestrate(plan, config, scheduler, cache, policy):
+    futures = submit_plan(plan, scheduler, cache, policy)
+    jobs = plan.by_resource_type()
+    # a sharded type imported by "all" has to wait for that import as well
+    everything = [job for job in plan.jobs if job["resources"] == "*"]
+    for resource_type in config.get("shards", {}):
+        jobs.setdefault(resource_type, []).extend(everything)
+    with span("orchestrate", jobs=len(plan.jobs), resource_types=len(jobs)):
+        with migration_pool(min(len(jobs), os.cpu_count()) or 1) as executor:
+            failed = await asyncio.gather(
+                *(
+                    migrate_when_imported(
+                        resource_type,
+                        [
+                            asyncio.wrap_future(futures[job["name"]])
+                            for job in type_jobs
+                        ],
+                        config,
+                        executor,
+                    )
+                    for resource_type, type_jobs in jobs.items()
+                )
+            )
+    _, failed_imports = report_plan(scheduler, cache, policy)
+    return failed_imports, [resource_type for resource_type in failed if resource_type]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import Datadog resources and migrate each resource type as soon as its imports finish"
+    )
+    parser.add_argument(
+        "--refresh",
+        help="comma separated resource types to re-import even if a cached import exists",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the previous run, skipping the imports and migrate steps it finished",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="only import the configured IDs that are not in the output of the previous run",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="with --delta, remove resources whose IDs are no longer configured",
+    )
+    args = parser.parse_args()
+
+    try:
+        config = load_config(CONF_PATH)
+    except ConfigError as e:
+        logger.error(f"Found {len(e.errors)} errors in conf.yaml:")
+        for error in e.errors:
+            logger.error(error)
+        sys.exit(1)
+
+    if "orgs" in config:
+        # every org is run by its own orchestrate.py with the same arguments
+        if not args.resume:
+            tracing.reset()
+        if asyncio.run(run_orgs(config, sys.argv[1:])):
+            sys.exit(1)
+        sys.exit(0)
+
+    start_journal(args.resume, delta=args.delta)
+
+    if not config["resources"]:
+        logger.error(
+            'No resources were defined in conf.yaml, did you mean to add "all"? Exiting, please reconfigure.'
+        )
+        sys.exit(1)
+
+    with span("build_plan"):
+        plan = build_plan(config, delta=args.delta)
+
+    tuner = Tuner(overrides=config.get("tuning"))
+    tuner.apply(plan)
+
+    cache = ImportCache(refresh=args.refresh.split(",") if args.refresh else ())
+    policy = RetryPolicy()
+    failed_imports, failed_migrations = asyncio.run(
+        orchestrate(plan, config, JobScheduler(), cache, policy)
+    )
+    tuner.record(plan, policy.stats)
+    tuner.save()
+
+    if args.delta and args.prune:
+        prune_removed(
+            config, skip=failed_types(plan, failed_imports) | set(failed_migrations)
+        )
+
+    post_process()
+
+    if failed_imports or failed_migrations:
+        sys.exit(1)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import sys
+
+from constants import TERRAFORM_DIR
+from validate_conf import CONFIG_CACHE_DIR
+
+logger = logging.getLogger()
+
+CODE_DIR = os.path.dirname(os.path.realpath(__file__))
+SHARED_CONCURRENCY_DIR = os.path.join(TERRAFORM_DIR, ".locks", "concurrency")
+# paths that default to somewhere under TERRAFORM_DIR; an override would be shared by
+# every org, so each org uses the default under its own directory instead
+PER_ORG_PATHS = [
+    "RUN_JOURNAL",
+    "INVENTORY_FILE",
+    "TUNING_FILE",
+    "IMPORT_LOG_DIR",
+    "IMPORT_CACHE_DIR",
+]
+
+
+def org_env(name, org):
+    # each org runs with its own credentials and work directory, while the validated
+    # config and the concurrency limit are shared
+    missing = [
+        org[setting]
+        for setting in ("api_key_env", "app_key_env")
+        if not os.environ.get(org[setting])
+    ]
+    if missing:
+        return None, missing
+    env = {key: val for key, val in os.environ.items() if key not in PER_ORG_PATHS}
+    # every org summarizes the spans of its own run
+    env.pop("TRACE_RUN", None)
+    env.update(
+        DD_ORG=name,
+        TERRAFORM_DIR=os.path.join(TERRAFORM_DIR, name),
+        CONFIG_CACHE_DIR=CONFIG_CACHE_DIR,
+        SHARED_CONCURRENCY_DIR=SHARED_CONCURRENCY_DIR,
+        DD_API_KEY=os.environ[org["api_key_env"]],
+        DD_APP_KEY=os.environ[org["app_key_env"]],
+        DATADOG_API_KEY=os.environ[org["api_key_env"]],
+        DATADOG_APP_KEY=os.environ[org["app_key_env"]],
+    )
+    if org.get("host_env"):
+        env.update(
+            DD_HOST=os.environ.get(org["host_env"], ""),
+            DATADOG_HOST=os.environ.get(org["host_env"], ""),
+        )
+    return env, []
+
+
+def prepare_org_dir(name):
+    # terraform is initialized once in TERRAFORM_DIR; Terraformer looks for the
+    # provider in its working directory, so every org links to the same one
+    org_dir = os.path.join(TERRAFORM_DIR, name)
+    os.makedirs(org_dir, exist_ok=True)
+    for entry in (".terraform", ".terraform.lock.hcl"):
+        source = os.path.join(TERRAFORM_DIR, entry)
+        link = os.path.join(org_dir, entry)
+        if os.path.exists(source) and not os.path.lexists(link):
+            os.symlink(source, link)
+    return org_dir
+
+
+async def run_org(name, env, args):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        os.path.join(CODE_DIR, "orchestrate.py"),
+        *args,
+        env=env,
+        cwd=CODE_DIR,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    async for line in process.stdout:
+        sys.stderr.write(f"[{name}] {line.decode(errors='replace')}")
+    return await process.wait()
+
+
+async def run_orgs(config, args):
+    # runs orchestrate.py once per org, all at the same time; MAX_CONCURRENCY caps the
+    # Terraformer calls of all orgs together
+    envs, errors = {}, []
+    for name, org in config["orgs"].items():
+        env, missing = org_env(name, org)
+        if missing:
+            errors.append(f'Org "{name}" is missing {", ".join(missing)}')
+        envs[name] = env
+    if errors:
+        for error in errors:
+            logger.error(error)
+        return sorted(config["orgs"])
+
+    for name in envs:
+        prepare_org_dir(name)
+    logger.info(
+        f'Importing {len(envs)} orgs with at most {os.environ.get("MAX_CONCURRENCY", 4)} Terraformer calls at a time'
+    )
+    codes = await asyncio.gather(
+        *(run_org(name, env, args) for name, env in envs.items())
+    )
+    failed = []
+    for name, code in zip(envs, codes):
+        if code != 0:
+            logger.error(f'Org "{name}" failed with exit code {code}')
+            failed.append(name)
+    logger.info(f"{len(envs) - len(failed)} of {len(envs)} orgs succeeded")
+    return failed
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import re
+
+from constants import DATADOG_DIR, TERRAFORM_DIR
+
+logger = logging.getLogger()
+
+# values are separated by colons, except where a value is wrapped in single quotes
+FILTER_VALUES = re.compile(r"'[^']*'|[^:]+")
+
+
+def filter_size(job):
+    return sum(
+        len(FILTER_VALUES.findall(f.split(";Value=", 1)[-1].rstrip('"')))
+        for f in job["filters"]
+    )
+
+
+class Plan:
+    def __init__(self, jobs=None):
+        self.jobs = []
+        self._keys = set()
+        for job in jobs or []:
+            self.add_job(job)
+
+    @staticmethod
+    def make_job(path, resource, filters=None):
+        if resource == "*":
+            output_dirs = [DATADOG_DIR]
+        else:
+            output_dirs = [
+                os.path.join(
+                    TERRAFORM_DIR, path.format(provider="datadog", service=res)
+                )
+                for res in resource.split(",")
+            ]
+        return {
+            "name": path.format(provider="datadog", service=resource),
+            "path": path,
+            "resources": resource,
+            "filters": list(filters or []),
+            "output_dirs": output_dirs,
+        }
+
+    def add(self, path, resource, filters=None):
+        return self.add_job(self.make_job(path, resource, filters))
+
+    def add_job(self, job):
+        key = (job["path"], job["resources"], tuple(job["filters"]))
+        if key in self._keys:
+            logger.info(f'Dropping redundant job "{job["name"]}" from plan')
+            return None
+        self._keys.add(key)
+        self.jobs.append(job)
+        return job
+
+    def select(self, only):
+        # only is a list of job names or resource types to keep
+        only = set(only)
+        return Plan(
+            [
+                job
+                for job in self.jobs
+                if job["name"] in only or only & set(job["resources"].split(","))
+            ]
+        )
+
+    def by_resource_type(self):
+        # jobs importing everything ("*") are left out, their output needs no migration
+        jobs = {}
+        for job in self.jobs:
+            if job["resources"] == "*":
+                continue
+            for resource in job["resources"].split(","):
+                jobs.setdefault(resource, []).append(job)
+        return jobs
+
+    def estimate(self):
+        filter_values = sum(filter_size(job) for job in self.jobs)
+        return {"jobs": len(self.jobs), "filter_values": filter_values}
+
+    def save(self, path):
+        with open(path, "w") as manifest:
+            json.dump({"version": 1, "jobs": self.jobs}, manifest, indent=2)
+        logger.info(f"Wrote plan with {len(self.jobs)} jobs to {path}")
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r") as manifest:
+                return cls(json.load(manifest)["jobs"])
+        except FileNotFoundError:
+            raise FileNotFoundError(f'Could not find plan manifest "{path}"')
@@ -0,0 +1,133 @@
+import fnmatch
+import json
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import DATADOG_DIR
+from fsutil import atomic_write
+from tfstate import replace_provider
+from tracing import span
+
+logger = logging.getLogger()
+
+PREFIX = b"tfer--"
+DELETE = object()
+PROVIDER_TF = b"""
+terraform {
+    required_providers {
+        datadog = {
+            source = "DataDog/datadog"
+            version = "= 3.34.0"
+        }
+    }
+}"""
+
+# a transform that does not need the file contents (reads=False) is passed None as data;
+# apply returns the new contents, or DELETE to remove the file
+Transform = namedtuple("Transform", ["name", "pattern", "apply", "reads"])
+
+
+def strip_prefix(path, data):
+    return data.replace(PREFIX, b"")
+
+
+def clean_state(path, data):
+    state = json.loads(data)
+    replaced = replace_provider(
+        state, "registry.terraform.io/-/datadog", "DataDog/datadog"
+    )
+    if not replaced and not state.get("outputs"):
+        return data
+    state["outputs"] = {}
+    state["serial"] = state.get("serial", 0) + 1
+    return (json.dumps(state, indent=2) + "\n").encode()
+
+
+def delete_file(path, data):
+    return DELETE
+
+
+def write_provider(path, data):
+    return PROVIDER_TF
+
+
+TRANSFORMS = [
+    Transform("remove_state_backups", "terraform.tfstate.*.backup", delete_file, False),
+    Transform("remove_outputs", "outputs.tf", delete_file, False),
+    Transform("write_provider", "provider.tf", write_provider, False),
+    Transform("strip_prefix", "*", strip_prefix, True),
+    Transform("clean_state", "terraform.tfstate", clean_state, True),
+]
+
+
+def process_file(path):
+    # runs every matching transform over the file, reading it at most once and
+    # writing or deleting it at most once; returns the time spent per transform, what
+    # happened to the file and the number of bytes written
+    timings = {}
+    name = os.path.basename(path)
+    original = data = None
+    for transform in TRANSFORMS:
+        if not fnmatch.fnmatchcase(name, transform.pattern):
+            continue
+        start = time.monotonic()
+        if transform.reads and data is None:
+            with open(path, "rb") as f:
+                original = data = f.read()
+        data = transform.apply(path, data)
+        timings[transform.name] = time.monotonic() - start
+        if data is DELETE:
+            os.remove(path)
+            return timings, "deleted", 0
+    if data is None or data == original:
+        return timings, None, 0
+    atomic_write(path, data)
+    return timings, "written", len(data)
+
+
+def walk_files(root):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+
+def run_pipeline(root, max_workers=None):
+    timings = {transform.name: 0.0 for transform in TRANSFORMS}
+    counts = {"scanned": 0, "written": 0, "deleted": 0, "bytes_written": 0}
+    start = time.monotonic()
+    with span("post_process", root=root) as attrs, ProcessPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        for file_timings, result, written in executor.map(
+            process_file, walk_files(root), chunksize=16
+        ):
+            counts["scanned"] += 1
+            counts["bytes_written"] += written
+            if result:
+                counts[result] += 1
+            for name, elapsed in file_timings.items():
+                timings[name] += elapsed
+        attrs.update(counts)
+        attrs.update({f"{name}_seconds": round(t, 3) for name, t in timings.items()})
+    logger.info(
+        f'Post-processed {counts["scanned"]} files under {root} in {time.monotonic() - start:.2f}s: '
+        f'{counts["written"]} written ({counts["bytes_written"]} bytes), {counts["deleted"]} deleted'
+    )
+    for name, elapsed in timings.items():
+        logger.info(f"  {name}: {elapsed:.2f}s")
+    return counts, timings
+
+
+if __name__ == "__main__":
+    logger.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    ch = logging.StreamHandler()
+    ch.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    run_pipeline(sys.argv[1] if len(sys.argv) > 1 else DATADOG_DIR)
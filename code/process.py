@@ -0,0 +1,45 @@
+import logging
+import os
+import signal
+import subprocess
+from collections import deque
+
+logger = logging.getLogger()
+
+# markers terraformer prints when an import is not going to succeed, even though it
+# may keep running for a long time and exit with code 0
+ABORT_MARKERS = [
+    "error initializing resources in service",
+    "Unable to refresh resource",
+    "cannot assign requested address",
+]
+
+
+def run_streaming(command, log_path, cwd=None, abort_markers=(), tail_lines=200):
+    # streams combined stdout/stderr line by line into log_path, keeping only a
+    # bounded tail in memory; the process is killed as soon as an abort marker shows up
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    tail = deque(maxlen=tail_lines)
+    aborted = None
+    with open(log_path, "a") as log, subprocess.Popen(
+        command,
+        shell=True,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        start_new_session=True,
+    ) as process:
+        log.write(f"$ {command}\n")
+        for line in process.stdout:
+            log.write(line)
+            tail.append(line)
+            aborted = next((m for m in abort_markers if m in line), None)
+            if aborted:
+                logger.debug(f'Found "{aborted}" in output, killing {process.pid}')
+                # the command runs through a shell, so kill its whole process group
+                os.killpg(process.pid, signal.SIGKILL)
+                break
+        returncode = process.wait()
+    return returncode, "".join(tail), aborted
@@ -0,0 +1,128 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from process import ABORT_MARKERS
+
+logger = logging.getLogger()
+
+TRANSIENT = "transient"
+RATE_LIMITED = "rate_limited"
+FATAL = "fatal"
+
+# terraformer exits with code 0 when a service fails to initialize or refresh, so these
+# markers mean the import failed whatever the exit code is
+EXIT_ZERO_FAILURES = re.compile("|".join(re.escape(m) for m in ABORT_MARKERS))
+# what went wrong with a failed import; resource names and counts can contain any
+# number, so status codes are only matched as part of an error message
+FAILURE_PATTERNS = [
+    (
+        RATE_LIMITED,
+        re.compile(
+            r"status code:? 429|429 Too Many Requests|rate limit exceeded",
+            re.IGNORECASE,
+        ),
+    ),
+    (
+        FATAL,
+        re.compile(
+            r"401 Unauthorized|403 Forbidden|status code:? 40[13]\b|invalid api key|unknown flag",
+            re.IGNORECASE,
+        ),
+    ),
+    (
+        TRANSIENT,
+        re.compile(
+            r"connection reset by peer|i/o timeout|TLS handshake timeout"
+            r"|status code:? 50[234]\b|50[234] (Bad Gateway|Service Unavailable|Gateway Time-?out)",
+            re.IGNORECASE,
+        ),
+    ),
+]
+
+
+class RetryPolicy:
+    def __init__(self, retries=None, base_delay=2.0, max_delay=120.0):
+        self.retries = int(
+            retries if retries is not None else os.environ.get("IMPORT_RETRIES", 3)
+        )
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def classify(self, returncode, stdout, stderr=""):
+        output = f"{stdout or ''}\n{stderr or ''}"
+        if returncode == 0 and not EXIT_ZERO_FAILURES.search(output):
+            return None
+        for category, pattern in FAILURE_PATTERNS:
+            if pattern.search(output):
+                return category
+        return TRANSIENT
+
+    def backoff(self, attempt, category):
+        # rate limits start from a longer delay so the API has time to recover
+        base = self.base_delay * (5 if category == RATE_LIMITED else 1)
+        ceiling = min(self.max_delay, base * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def execute(self, name, attempt_func):
+        # attempt_func runs the job once and returns (returncode, stdout, stderr,
+        # aborted); an attempt that was killed early on a known marker failed fast, so
+        # it is retried right away unless it was rate limited
+        attempts, wasted, rate_limited = 0, 0.0, 0
+        began = time.monotonic()
+        while True:
+            attempts += 1
+            start = time.monotonic()
+            returncode, stdout, stderr, aborted = attempt_func()
+            category = self.classify(returncode, stdout, stderr)
+            if category is None:
+                self._record(name, attempts, wasted, None, rate_limited, began)
+                return True
+            wasted += time.monotonic() - start
+            rate_limited += category == RATE_LIMITED
+            error = (stderr or stdout or "").strip()
+            if category == FATAL or attempts > self.retries:
+                logger.error(
+                    f"[{name}] Failed with {category} error after {attempts} attempts: {error}"
+                )
+                self._record(name, attempts, wasted, category, rate_limited, began)
+                return False
+            if aborted and category != RATE_LIMITED:
+                logger.warning(
+                    f"[{name}] Attempt {attempts} was aborted with {category} error, retrying now: {error}"
+                )
+                continue
+            delay = self.backoff(attempts, category)
+            logger.warning(
+                f"[{name}] Attempt {attempts} failed with {category} error, retrying in {delay:.1f}s: {error}"
+            )
+            time.sleep(delay)
+            wasted += delay
+
+    def _record(self, name, attempts, wasted, category, rate_limited, began):
+        with self._lock:
+            self.stats[name] = {
+                "attempts": attempts,
+                "wasted_seconds": wasted,
+                "failure": category,
+                "rate_limited": rate_limited,
+                "seconds": time.monotonic() - began,
+            }
+
+    def summary(self):
+        retried = {
+            name: stat for name, stat in self.stats.items() if stat["attempts"] > 1
+        }
+        total_wasted = sum(stat["wasted_seconds"] for stat in self.stats.values())
+        logger.info(
+            f"{len(retried)} jobs needed retries, {total_wasted:.1f}s spent on failed attempts and backoff"
+        )
+        for name, stat in retried.items():
+            logger.info(
+                f'  {name}: {stat["attempts"]} attempts, {stat["wasted_seconds"]:.1f}s wasted'
+            )
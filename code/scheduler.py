@@ -0,0 +1,81 @@
+import fcntl
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+
+class SharedSlots:
+    # a concurrency limit shared by several processes, such as the runs of each org:
+    # a slot is held by taking an exclusive lock on one of count lock files. Without a
+    # lock_dir there is no limit beyond each process' own scheduler
+    def __init__(self, lock_dir=None, count=None, poll=0.2):
+        self.lock_dir = lock_dir or os.environ.get("SHARED_CONCURRENCY_DIR")
+        self.count = count or int(os.environ.get("MAX_CONCURRENCY", 4))
+        self.poll = poll
+
+    @contextmanager
+    def hold(self):
+        if not self.lock_dir:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            for slot in random.sample(range(self.count), self.count):
+                lock = open(os.path.join(self.lock_dir, f"{slot}.lock"), "w")
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                    lock.close()
+                return
+            time.sleep(self.poll)
+
+
+class JobScheduler:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or int(os.environ.get("MAX_CONCURRENCY", 4))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="job"
+        )
+        self.jobs = {}
+
+    def submit(self, name, func, *args, **kwargs):
+        if name in self.jobs:
+            logger.warning(f'Job "{name}" was already scheduled, skipping duplicate')
+            return self.jobs[name]
+        logger.debug(f'Scheduling job "{name}"')
+        self.jobs[name] = self.executor.submit(func, *args, **kwargs)
+        return self.jobs[name]
+
+    def wait(self):
+        self.executor.shutdown(wait=True)
+        succeeded, failed = [], []
+        for name, future in self.jobs.items():
+            if future.exception() is None and future.result():
+                succeeded.append(name)
+            else:
+                if future.exception() is not None:
+                    logger.error(f'Job "{name}" raised: {future.exception()!r}')
+                failed.append(name)
+        return succeeded, failed
+
+    def summary(self):
+        succeeded, failed = self.wait()
+        logger.info(
+            f"{len(succeeded)} of {len(self.jobs)} jobs succeeded with a max concurrency of {self.max_workers}"
+        )
+        for name in succeeded:
+            logger.info(f"  succeeded: {name}")
+        for name in failed:
+            logger.error(f"  failed: {name}")
+        return succeeded, failed
@@ -0,0 +1,136 @@
+import logging
+import os
+import re
+import shutil
+import uuid
+import zlib
+
+from constants import DATADOG_DIR
+from hcl import split_blocks
+from tfstate import load_state, resource_address, resource_id, write_state
+from tracing import span
+
+logger = logging.getLogger()
+
+UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def resource_tags(resource):
+    instances = resource.get("instances") or [{}]
+    return instances[0].get("attributes", {}).get("tags") or []
+
+
+def tagset_names(config, resource_type):
+    # tagsets are AND searches, so a resource belongs to the first tagset whose tags it
+    # all carries, in the order of conf.yaml
+    tagsets = {}
+    for resource_conf in config["resources"]:
+        for conf in resource_conf.get(resource_type) or []:
+            if not isinstance(conf, dict):
+                continue
+            for tagset in conf.get("tagsets") or []:
+                tagsets.update(
+                    (name, {tag.strip().lower() for tag in tags or []})
+                    for name, tags in tagset.items()
+                )
+    return tagsets
+
+
+def shard_function(layout, tagsets):
+    # returns a function mapping a state resource to the name of its shard, and the
+    # shard for resource blocks that are not in the state
+    if layout["by"] == "hash":
+        count = layout["count"]
+        width = len(str(count - 1))
+
+        def by_hash(resource):
+            key = resource_id(resource) or resource_address(resource)
+            return f"shard_{zlib.crc32(key.encode()) % count:0{width}d}"
+
+        return by_hash, by_hash({"type": "unassigned", "name": ""})
+
+    if layout["by"] == "tag":
+        prefix = f'{layout["tag"]}:'
+
+        def by_tag(resource):
+            for tag in resource_tags(resource):
+                if tag.startswith(prefix) and tag[len(prefix) :]:
+                    return UNSAFE_CHARS.sub("_", tag[len(prefix) :])
+            return "untagged"
+
+        return by_tag, "untagged"
+
+    def by_tagset(resource):
+        tags = set(resource_tags(resource))
+        return next((name for name, req in tagsets.items() if req <= tags), "other")
+
+    return by_tagset, "other"
+
+
+def shard_resource_type(resource_type, layout, config):
+    # splits datadog/<type> into one root module per shard, each holding its own
+    # <type>.tf, terraform.tfstate and copies of the remaining files such as provider.tf
+    type_dir = f"{DATADOG_DIR}/{resource_type}"
+    state_path = f"{type_dir}/terraform.tfstate"
+    tf_path = f"{type_dir}/{resource_type}.tf"
+    if not os.path.exists(state_path):
+        logger.warning(f"No state found for {resource_type}, skipping sharding")
+        return {}
+
+    with span("shard_resource_type", resource_type=resource_type, **layout) as attrs:
+        state = load_state(state_path)
+        assign, fallback = shard_function(layout, tagset_names(config, resource_type))
+        shards, placement = {}, {}
+        for res in state.get("resources", []):
+            shard = assign(res)
+            shards.setdefault(shard, []).append(res)
+            placement[resource_address(res)] = shard
+
+        others = [
+            name
+            for name in os.listdir(type_dir)
+            if os.path.isfile(f"{type_dir}/{name}")
+            and name != f"{resource_type}.tf"
+            and not name.startswith("terraform.tfstate")
+        ]
+        for shard in shards:
+            os.makedirs(f"{type_dir}/{shard}", exist_ok=True)
+
+        def dest_path(address):
+            shard = placement.get(address)
+            if shard is None:
+                logger.warning(
+                    f"Resource {address} is not in the {resource_type} state, adding it to shard {fallback}"
+                )
+                shard = placement[address] = fallback
+                os.makedirs(f"{type_dir}/{shard}", exist_ok=True)
+            return f"{type_dir}/{shard}/{resource_type}.tf"
+
+        if os.path.exists(tf_path):
+            split_blocks(tf_path, dest_path)
+
+        for shard in set(placement.values()):
+            for name in others:
+                shutil.copy2(f"{type_dir}/{name}", f"{type_dir}/{shard}/{name}")
+            # every shard is a separate state, so it gets its own lineage
+            shard_state = {key: val for key, val in state.items() if key != "resources"}
+            shard_state.update(
+                lineage=str(uuid.uuid4()), serial=1, resources=shards.get(shard, [])
+            )
+            write_state(f"{type_dir}/{shard}/terraform.tfstate", shard_state)
+
+        # the merged state goes last, it marks the shards as incomplete until then
+        for name in os.listdir(type_dir):
+            if os.path.isfile(f"{type_dir}/{name}") and name != "terraform.tfstate":
+                os.remove(f"{type_dir}/{name}")
+        os.remove(state_path)
+        counts = {
+            shard: len(shards.get(shard, [])) for shard in set(placement.values())
+        }
+        attrs["shards"] = len(counts)
+
+    logger.info(
+        f'Split {resource_type} into {len(counts)} shards by {layout["by"]}: '
+        + ", ".join(f"{shard} ({count})" for shard, count in sorted(counts.items()))
+    )
+    return counts
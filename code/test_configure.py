@@ -0,0 +1,126 @@
+import pytest
+
+import configure
+from plan import Plan
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    monkeypatch.setattr(configure, "plan", Plan())
+    monkeypatch.setattr(configure, "existing", {})
+    return configure.plan
+
+
+def test_missing_ids_are_found_before_quoting(plan):
+    configure.existing["integration_aws_lambda_arn"] = {"arn:aws:lambda:1"}
+    configure.handle_list_resources(
+        {"integration_aws_lambda_arn": ["arn:aws:lambda:1", "arn:aws:lambda:2"]}
+    )
+    assert [(job["path"], job["filters"]) for job in plan.jobs] == [
+        (
+            "{provider}/{service}/delta",
+            ["--filter=\"Name=lambda_arn;Value='arn:aws:lambda:2'\""],
+        )
+    ]
+
+
+def test_nothing_is_imported_when_no_ids_are_missing(plan):
+    configure.existing["dashboard"] = {"abc"}
+    configure.handle_list_resources({"dashboard": ["abc"]})
+    assert plan.jobs == []
+
+
+def test_prune_removed(plan, monkeypatch):
+    pruned = []
+    monkeypatch.setattr(
+        configure, "prune", lambda resource, keep: pruned.append((resource, keep))
+    )
+    configure.existing.update(
+        {
+            name: set()
+            for name in (
+                "dashboard",
+                "role",
+                "monitor",
+                "synthetics_test",
+                "logs_index",
+            )
+        }
+    )
+    config = {
+        "resources": [
+            {"dashboard": ["abc"]},
+            {"role": None},
+            {"monitor": [{"ids": [1]}, {"ids": [2]}]},
+            {"synthetics_test": [{"ids": ["x"]}, {"tags": ["env:prod"]}]},
+            {"logs_index": ["main"]},
+            {"dashboard_list": [1]},
+        ]
+    }
+
+    configure.prune_removed(config, skip={"logs_index"})
+    assert pruned == [("dashboard", ["abc"]), ("monitor", [1, 2])]
+
+    pruned.clear()
+    configure.prune_removed(config, skip={"*"})
+    assert pruned == []
+
+
+def test_ids_entries_are_merged():
+    ids, selectors = configure.collapse_selectors(
+        "monitor", [{"ids": [1, 2]}, {"ids": [2, 3]}]
+    )
+    assert (ids, selectors) == ([1, 2, 3], [])
+
+
+@pytest.mark.parametrize(
+    "confs",
+    [
+        [{"tags": ["env:prod"]}, {"tags": ["env:prod", "team:a"]}],
+        [{"tags": ["env:prod", "team:a"]}, {"tags": ["env:prod"]}],
+    ],
+)
+def test_narrower_tags_are_dropped(confs):
+    _, selectors = configure.collapse_selectors("monitor", confs)
+    assert selectors == [("tags", "tags", ("env:prod",))]
+
+
+def test_narrower_tagset_is_dropped():
+    _, selectors = configure.collapse_selectors(
+        "monitor",
+        [
+            {"tagsets": [{"prod_a": ["env:prod", "team:a"]}]},
+            {"tags": ["env:prod"]},
+        ],
+    )
+    assert selectors == [("tags", "tags", ("env:prod",))]
+
+
+def test_tags_are_compared_after_normalizing():
+    _, selectors = configure.collapse_selectors(
+        "monitor",
+        [
+            {"tags": ["Env:Prod ", "team:a"]},
+            {"tagsets": [{"same": ["team:a", "env:prod", "TEAM:A"]}]},
+        ],
+    )
+    assert selectors == [("tags", "tags", ("env:prod", "team:a"))]
+
+
+def test_tags_entries_are_imported_side_by_side(plan):
+    configure.handle_nested_resources(
+        {
+            "monitor": [
+                {"tags": ["env:prod"]},
+                {"tags": ["team:a"]},
+                {"tagsets": [{"staging": ["env:staging"]}]},
+            ],
+            "synthetics_test": [{"tags": ["env:prod"]}],
+        }
+    )
+    assert [job["name"] for job in plan.jobs] == [
+        "datadog/monitor/tags/0000",
+        "datadog/monitor/tags/0001",
+        "datadog/monitor/tagsets/staging",
+        "datadog/synthetics_test/tags",
+    ]
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import delta
+from hcl import index_blocks
+from tfstate import load_state
+
+
+@pytest.fixture
+def datadog_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(delta, "DATADOG_DIR", str(tmp_path))
+    return tmp_path
+
+
+def resource(name, **attributes):
+    return {
+        "mode": "managed",
+        "type": "datadog_monitor",
+        "name": name,
+        "instances": [{"attributes": attributes}],
+    }
+
+
+def test_configured_id():
+    assert delta.configured_id("monitor", resource("a", id=12)) == "12"
+    assert delta.configured_id("monitor", {"name": "a"}) == ""
+    # integration_azure is filtered on client_id, its ID is tenant_name:client_id
+    azure = resource("azure", id="tenant:abc", client_id="abc")
+    assert delta.configured_id("integration_azure", azure) == "abc"
+    assert delta.configured_id("integration_azure", resource("b", id="t:c")) == ""
+
+
+def test_prune(datadog_dir):
+    type_dir = datadog_dir / "monitor"
+    type_dir.mkdir()
+    resources = [
+        resource("a", id="1"),
+        resource("b", id="2"),
+        # cannot be matched against conf.yaml without its ID, so it is kept
+        resource("c"),
+        {**resource("d", id="4"), "mode": "data"},
+    ]
+    (type_dir / "terraform.tfstate").write_text(
+        json.dumps({"version": 4, "serial": 2, "resources": resources})
+    )
+    (type_dir / "monitor.tf").write_text(
+        "".join(f'resource "datadog_monitor" "{name}" {{\n}}\n\n' for name in "abc")
+    )
+
+    assert delta.prune("monitor", [1]) == ["datadog_monitor.b"]
+
+    state = load_state(type_dir / "terraform.tfstate")
+    assert [res["name"] for res in state["resources"]] == ["a", "c", "d"]
+    assert state["serial"] == 3
+    blocks = index_blocks(type_dir / "monitor.tf")
+    assert [block.name for block in blocks] == ["a", "c"]
+    assert delta.prune("monitor", [1]) == []
+    assert delta.prune("dashboard", []) == []
@@ -0,0 +1,57 @@
+from hcl import copy_blocks, index_blocks
+
+FIRST = b"""resource "datadog_monitor" "first" {
+  name    = "first"
+  message = "braces { in a string } and # not a comment // either"
+}
+
+"""
+HEREDOC = b"""resource "datadog_monitor" "heredoc" {
+  message = <<EOT
+closing brace on its own line
+}
+resource "datadog_monitor" "not_a_block" {
+EOT
+  query = "escaped \\" quote { still in the string"
+  # a comment with a brace {
+  // another one }
+}
+
+"""
+LAST = b"""resource "datadog_dashboard" "last" {
+  widget {
+    title = "#1 // widget"
+  }
+}
+"""
+
+
+def write_tf(tmp_path, *blocks):
+    path = tmp_path / "monitor.tf"
+    path.write_bytes(b"".join(blocks))
+    return path
+
+
+def test_index_blocks(tmp_path):
+    path = write_tf(tmp_path, FIRST, HEREDOC, LAST)
+    blocks = index_blocks(path)
+    assert [(block.type, block.name) for block in blocks] == [
+        ("datadog_monitor", "first"),
+        ("datadog_monitor", "heredoc"),
+        ("datadog_dashboard", "last"),
+    ]
+    data = path.read_bytes()
+    assert data[blocks[0].start : blocks[0].end] == FIRST.rstrip(b"\n") + b"\n"
+    assert data[blocks[1].start : blocks[1].end] == HEREDOC.rstrip(b"\n") + b"\n"
+    assert data[blocks[2].start : blocks[2].end] == LAST
+
+
+def test_copy_blocks_drops_middle_block(tmp_path):
+    source = write_tf(tmp_path, FIRST, HEREDOC, LAST)
+    dest = tmp_path / "combined.tf"
+    dest.write_bytes(b"# existing\n")
+    removed = copy_blocks(
+        source, dest, drop=["datadog_monitor.heredoc", "datadog_monitor.missing"]
+    )
+    assert removed == ["datadog_monitor.heredoc"]
+    assert dest.read_bytes() == b"# existing\n" + FIRST + b"\n" + LAST
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import journal
+import migrate
+from tfstate import load_state
+
+
+@pytest.fixture
+def datadog_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate, "TERRAFORM_DIR", str(tmp_path))
+    monkeypatch.setattr(migrate, "DATADOG_DIR", str(tmp_path / "datadog"))
+    monkeypatch.setattr(journal, "JOURNAL_FILE", str(tmp_path / ".journal.jsonl"))
+    monkeypatch.setattr(journal, "_entries", None)
+    journal.reset()
+    return tmp_path / "datadog"
+
+
+def write_import(path, names, marker):
+    path.mkdir(parents=True)
+    resources = [
+        {
+            "mode": "managed",
+            "type": "datadog_monitor",
+            "name": name,
+            "instances": [{"attributes": {"id": name, "marker": marker}}],
+        }
+        for name in names
+    ]
+    (path / "terraform.tfstate").write_text(
+        json.dumps(
+            {"version": 4, "serial": 1, "lineage": marker, "resources": resources}
+        )
+    )
+    (path / "monitor.tf").write_text(
+        "".join(f'resource "datadog_monitor" "{name}" {{\n}}\n\n' for name in names)
+    )
+
+
+def test_rerun_replaces_stale_state(datadog_dir):
+    # the output of an earlier run is replaced, not used to drop fresh imports
+    write_import(datadog_dir / "monitor", ["a", "b", "c"], "stale")
+    write_import(datadog_dir / "monitor" / "ids", ["a", "b"], "fresh")
+    write_import(datadog_dir / "monitor" / "tags", ["b", "c"], "fresh")
+
+    migrate.migrate_resource_type("monitor", ["ids", "tags"], {})
+
+    state = load_state(datadog_dir / "monitor" / "terraform.tfstate")
+    assert [res["name"] for res in state["resources"]] == ["a", "b", "c"]
+    assert {
+        res["instances"][0]["attributes"]["marker"] for res in state["resources"]
+    } == {"fresh"}
+    tf = (datadog_dir / "monitor" / "monitor.tf").read_text()
+    assert tf.count("resource ") == 3
+
+
+def test_delta_adds_to_existing_state(datadog_dir):
+    journal.record("delta", journal.DONE)
+    write_import(datadog_dir / "monitor", ["a", "b"], "existing")
+    write_import(datadog_dir / "monitor" / "ids", ["b", "c"], "delta")
+
+    migrate.migrate_resource_type("monitor", ["ids"], {})
+
+    state = load_state(datadog_dir / "monitor" / "terraform.tfstate")
+    assert [
+        (res["name"], res["instances"][0]["attributes"]["marker"])
+        for res in state["resources"]
+    ] == [("a", "existing"), ("b", "existing"), ("c", "delta")]
@@ -0,0 +1,38 @@
+import pytest
+
+from retry import FATAL, RATE_LIMITED, TRANSIENT, RetryPolicy
+
+
+@pytest.mark.parametrize(
+    "returncode,output,category",
+    [
+        (0, "Filtered number of resources for service monitor: 429", None),
+        (0, "Refreshing state... tfer--dashboard_abc-502-xyz", None),
+        (0, "rate limit exceeded, retrying in 1s", None),
+        (0, "datadog error initializing resources in service", TRANSIENT),
+        (0, "error initializing resources in service: status code: 429", RATE_LIMITED),
+        (1, "Error: 429 Too Many Requests", RATE_LIMITED),
+        (1, "403 Forbidden", FATAL),
+        (1, "status code: 503", TRANSIENT),
+        (1, "2 resources named 429", TRANSIENT),
+    ],
+)
+def test_classify(returncode, output, category):
+    assert RetryPolicy(retries=0).classify(returncode, output) == category
+
+
+@pytest.mark.parametrize(
+    "output,slept",
+    [
+        ("error initializing resources in service", []),
+        ("error initializing resources in service: status code: 429", [True]),
+    ],
+)
+def test_aborted_attempt_is_retried_without_backoff(monkeypatch, output, slept):
+    sleeps = []
+    monkeypatch.setattr("retry.time.sleep", sleeps.append)
+    results = iter([(0, output, "", True), (0, "", "", False)])
+    policy = RetryPolicy(retries=1)
+    assert policy.execute("job", lambda: next(results))
+    assert [delay > 0 for delay in sleeps] == slept
+    assert policy.stats["job"]["attempts"] == 2
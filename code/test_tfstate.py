@@ -0,0 +1,79 @@
+import json
+
+from tfstate import find_duplicates, load_state, merge_state
+
+
+def resource(name, id, type="datadog_monitor"):
+    return {
+        "mode": "managed",
+        "type": type,
+        "name": name,
+        "instances": [{"attributes": {"id": id}}],
+    }
+
+
+def write_state(path, resources, **fields):
+    path.write_text(json.dumps({"version": 4, "resources": resources, **fields}))
+    return path
+
+
+def test_merge_into_missing_destination(tmp_path):
+    source = write_state(
+        tmp_path / "source.tfstate",
+        [resource("a", "1"), resource("b", "2")],
+        serial=7,
+        lineage="source",
+    )
+    dest = tmp_path / "dest.tfstate"
+    moved, conflicts = merge_state(source, dest, drop=["datadog_monitor.b"])
+    assert (moved, conflicts) == (["datadog_monitor.a"], [])
+    state = load_state(dest)
+    assert state["serial"] == 1
+    assert state["lineage"] == "source"
+    assert [res["name"] for res in state["resources"]] == ["a"]
+
+
+def test_merge_into_existing_destination(tmp_path):
+    source = write_state(
+        tmp_path / "source.tfstate",
+        [resource("a", "1"), resource("c", "3")],
+        serial=7,
+        lineage="source",
+    )
+    dest = write_state(
+        tmp_path / "dest.tfstate", [resource("a", "1")], serial=3, lineage="dest"
+    )
+    written = []
+    moved, conflicts = merge_state(
+        source, dest, before_write=lambda serial, conflicts: written.append(serial)
+    )
+    assert (moved, conflicts) == (["datadog_monitor.c"], ["datadog_monitor.a"])
+    state = load_state(dest)
+    assert written == [4]
+    assert (state["serial"], state["lineage"]) == (4, "dest")
+    assert [res["name"] for res in state["resources"]] == ["a", "c"]
+
+
+def test_merge_without_changes_leaves_destination_alone(tmp_path):
+    source = write_state(tmp_path / "source.tfstate", [resource("a", "1")])
+    dest = write_state(
+        tmp_path / "dest.tfstate", [resource("a", "1")], serial=3, lineage="dest"
+    )
+    assert merge_state(source, dest) == ([], ["datadog_monitor.a"])
+    assert load_state(dest)["serial"] == 3
+
+
+def test_find_duplicates(tmp_path):
+    first = write_state(tmp_path / "first.tfstate", [resource("a", "1")])
+    second = write_state(
+        tmp_path / "second.tfstate",
+        [
+            resource("a", "9"),
+            resource("renamed", "1"),
+            resource("other_type", "1", type="datadog_dashboard"),
+            resource("b", "2"),
+        ],
+    )
+    assert find_duplicates([first, tmp_path / "missing.tfstate", second]) == {
+        second: ["datadog_monitor.a", "datadog_monitor.renamed"]
+    }
@@ -0,0 +1,43 @@
+import logging
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "trace.json"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    monkeypatch.setattr(tracing, "events", [])
+    return path
+
+
+def test_summary_includes_spans_of_other_processes(trace_file, caplog, monkeypatch):
+    with tracing.span("earlier_run"):
+        pass
+    tracing.flush()
+    tracing.reset()
+    assert tracing.load() == []
+
+    with tracing.span("worker"):
+        pass
+    tracing.flush()
+    run = tracing.TRACE_RUN
+    monkeypatch.setattr(tracing, "TRACE_RUN", "other")
+    with tracing.span("other_run"):
+        pass
+    tracing.flush()
+    monkeypatch.setattr(tracing, "TRACE_RUN", run)
+    with tracing.span("main"):
+        pass
+
+    with caplog.at_level(logging.INFO):
+        tracing._flush_at_exit()
+    assert [event["name"] for event in tracing.load()] == [
+        "worker",
+        "other_run",
+        "main",
+    ]
+    assert "Top 2 slowest spans:" in caplog.text
+    assert "other_run" not in caplog.text
@@ -0,0 +1,218 @@
+import pytest
+
+import validate_conf
+from validate_conf import ConfigError, load_config, validate
+
+VALID = b"""
+resources:
+  - dashboard:
+      - abc-123
+  - role:
+  - user:
+  - logs_archive_order:
+  - monitor:
+      - ids:
+          - 1
+          - 2
+      - tags:
+          - env:prod
+      - tagsets:
+          - team_a:
+              - team:a
+shards:
+  monitor:
+    by: tagset
+  dashboard:
+    by: hash
+    count: 4
+tuning:
+  monitor:
+    retry_number: 3
+    retry_sleep_ms: 500
+"""
+
+
+def errors_of(data):
+    return validate(data)[1]
+
+
+def test_valid_config():
+    config, errors = validate(VALID)
+    assert errors == []
+    assert config == {
+        "resources": [
+            {"dashboard": ["abc-123"]},
+            {"role": None},
+            {"user": None},
+            {"logs_archive_order": None},
+            {
+                "monitor": [
+                    {"ids": [1, 2]},
+                    {"tags": ["env:prod"]},
+                    {"tagsets": [{"team_a": ["team:a"]}]},
+                ]
+            },
+        ],
+        "shards": {
+            "monitor": {"by": "tagset"},
+            "dashboard": {"by": "hash", "count": 4},
+        },
+        "tuning": {"monitor": {"retry_number": 3, "retry_sleep_ms": 500}},
+    }
+
+
+def test_errors_are_collected_with_line_numbers():
+    errors = errors_of(
+        b"""resources:
+  - dashboard:
+      - abc
+  - not_a_resource:
+  - logs_archive_order:
+      - 1
+unknown: true
+"""
+    )
+    assert [error.split(":")[0] for error in errors] == ["line 4", "line 6", "line 7"]
+    assert "'not_a_resource' found in config, but it is not supported" in errors[0]
+    assert "Unknown key 'unknown'" in errors[2]
+
+
+def test_scalar_types():
+    errors = errors_of(
+        b"""resources:
+  - dashboard_list:
+      - 12
+      - abc
+  - dashboard:
+      - 34
+  - monitor:
+      - ids:
+          - xyz
+"""
+    )
+    assert [error.split(":")[0] for error in errors] == ["line 4", "line 6", "line 9"]
+    assert "list of integers" in errors[0]
+    assert "list of strings" in errors[1]
+
+
+def test_null_values():
+    config, errors = validate(
+        b"""resources:
+  - role:
+  - metric_metadata:
+  - monitor:
+      - ids:
+"""
+    )
+    assert config["resources"][0] == {"role": None}
+    assert [error.split(":")[0] for error in errors] == ["line 3", "line 5"]
+
+
+def test_duplicate_ids_are_dropped():
+    config, errors = validate(
+        b"""resources:
+  - dashboard: [a, b, a]
+  - monitor:
+      - ids: [1, 2, 1]
+"""
+    )
+    assert errors == []
+    assert config["resources"] == [
+        {"dashboard": ["a", "b"]},
+        {"monitor": [{"ids": [1, 2]}]},
+    ]
+
+
+def test_shards_and_tuning_errors():
+    errors = errors_of(
+        b"""resources:
+  - monitor:
+      - tags: [env:prod]
+shards:
+  monitor:
+    by: tagset
+  dashboard:
+    by: hash
+tuning:
+  monitor:
+    retry_number: -1
+"""
+    )
+    assert len(errors) == 3
+    assert errors[0].startswith("line 8:")
+    assert "Invalid tuning setting 'retry_number'" in errors[1]
+    assert "'monitor' is sharded by tagset, but has no tagsets" in errors[2]
+
+
+def test_orgs():
+    config, errors = validate(
+        b"""tuning:
+  monitor:
+    retry_number: 3
+orgs:
+  prod:
+    api_key_env: PROD_KEY
+    app_key_env: PROD_APP
+    resources:
+      - dashboard:
+"""
+    )
+    assert errors == []
+    assert validate_conf.org_config(config, "prod") == {
+        "tuning": {"monitor": {"retry_number": 3}},
+        "api_key_env": "PROD_KEY",
+        "app_key_env": "PROD_APP",
+        "resources": [{"dashboard": None}],
+    }
+    with pytest.raises(ConfigError):
+        validate_conf.org_config(config, "missing")
+
+
+def test_orgs_errors():
+    errors = errors_of(
+        b"""resources:
+  - dashboard:
+orgs:
+  bad name:
+    resources:
+  good:
+    api_key_env: 3
+    resources:
+"""
+    )
+    assert [error.split(":")[0] for error in errors] == [
+        "line 4",
+        "line 7",
+        "line 6",
+        "line 6",
+        "line 1",
+    ]
+    assert "Invalid org name 'bad name'" in errors[0]
+    assert "Org 'good' has no 'app_key_env'" in errors[3]
+    assert "either a 'resources' list or 'orgs'" in errors[4]
+
+
+def test_load_config_uses_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(validate_conf, "CONFIG_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(validate_conf, "ORG", None)
+    path = tmp_path / "conf.yaml"
+    path.write_bytes(VALID)
+    config = load_config(str(path))
+
+    def fail(data):
+        raise AssertionError("validated again")
+
+    monkeypatch.setattr(validate_conf, "validate", fail)
+    assert load_config(str(path)) == config
+    path.write_bytes(VALID + b"\n")
+    with pytest.raises(AssertionError):
+        load_config(str(path))
+
+
+def test_load_config_raises_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(validate_conf, "CONFIG_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "conf.yaml"
+    path.write_bytes(b"resources:\n  - dashboard: 1\n")
+    with pytest.raises(ConfigError) as e:
+        load_config(str(path))
+    assert e.value.errors[0].startswith("line 2:")
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+
+from fsutil import atomic_write
+
+logger = logging.getLogger()
+
+
+def load_state(path):
+    with open(path, "r") as tfstate:
+        return json.load(tfstate)
+
+
+def write_state(path, state):
+    atomic_write(path, (json.dumps(state, indent=2) + "\n").encode())
+
+
+def resource_address(resource):
+    address = f'{resource["type"]}.{resource["name"]}'
+    if resource.get("mode") == "data":
+        address = f"data.{address}"
+    if resource.get("module"):
+        address = f'{resource["module"]}.{address}'
+    return address
+
+
+def resource_id(resource):
+    instances = resource.get("instances") or [{}]
+    return str(instances[0].get("attributes", {}).get("id", ""))
+
+
+def state_addresses(state):
+    return [resource_address(res) for res in state.get("resources", [])]
+
+
+def merge_state(source_path, dest_path, before_write=None, drop=()):
+    source = load_state(source_path)
+    if os.path.exists(dest_path):
+        dest = load_state(dest_path)
+    else:
+        dest = {key: val for key, val in source.items() if key != "resources"}
+        dest["resources"] = []
+        dest["serial"] = 0
+
+    # conflicts are determined before anything is moved, so the destination is
+    # either fully updated or not written at all
+    existing = set(state_addresses(dest))
+    drop = set(drop)
+    moved, conflicts = [], []
+    for res in source.get("resources", []):
+        address = resource_address(res)
+        if address in drop:
+            continue
+        if address in existing:
+            conflicts.append(address)
+        else:
+            existing.add(address)
+            moved.append(res)
+
+    if moved:
+        dest["resources"].extend(moved)
+        dest["serial"] = dest.get("serial", 0) + 1
+        if not dest.get("lineage"):
+            dest["lineage"] = source.get("lineage")
+        if before_write:
+            before_write(dest["serial"], conflicts)
+        write_state(dest_path, dest)
+
+    logger.debug(
+        f"Merged {len(moved)} resources from {source_path} into {dest_path}, {len(conflicts)} conflicts"
+    )
+    return [resource_address(res) for res in moved], conflicts
+
+
+def find_duplicates(paths):
+    # indexes every resource of the states in paths, in order, and returns per path the
+    # addresses to leave out because an earlier state already has them, either under the
+    # same address or as the same Datadog object under a different address
+    addresses, objects = set(), {}
+    duplicates = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for res in load_state(path).get("resources", []):
+            address = resource_address(res)
+            key = (res["type"], resource_id(res))
+            if address in addresses:
+                duplicates.setdefault(path, []).append(address)
+            elif res.get("mode") != "data" and key[1] and key in objects:
+                logger.info(
+                    f"{address} in {path} is the same object as {objects[key]}, leaving it out"
+                )
+                duplicates.setdefault(path, []).append(address)
+            else:
+                addresses.add(address)
+                if key[1]:
+                    objects.setdefault(key, address)
+    return duplicates
+
+
+def state_serial(path):
+    try:
+        return load_state(path).get("serial")
+    except FileNotFoundError:
+        return None
+
+
+def provider_address(source):
+    # expand a provider source such as "DataDog/datadog" to the fully qualified
+    # address terraform stores in state
+    parts = source.lower().split("/")
+    if len(parts) == 2:
+        parts.insert(0, "registry.terraform.io")
+    return "/".join(parts)
+
+
+def replace_provider(state, old, new):
+    old, new = provider_address(old), provider_address(new)
+    replaced = 0
+    for res in state.get("resources", []):
+        if res.get("provider") == f'provider["{old}"]':
+            res["provider"] = f'provider["{new}"]'
+            replaced += 1
+    return replaced
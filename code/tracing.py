@@ -0,0 +1,101 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# tracing is opt-in: set TRACE_FILE to the path of a Chrome trace-event JSON file; every
+# process of a run adds its spans to the same file
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_TOP = int(os.environ.get("TRACE_TOP", 10))
+# spans are tagged with the pid of the process that started the run; the processes it
+# starts inherit it, so its summary includes the spans of its migrate workers
+TRACE_RUN = os.environ.setdefault("TRACE_RUN", str(os.getpid()))
+
+events = []
+
+
+@contextmanager
+def span(name, category="stage", **args):
+    if not TRACE_FILE:
+        yield args
+        return
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": int(start_wall * 1e6),
+                "dur": int((time.perf_counter() - start) * 1e6),
+                "pid": os.getpid(),
+                "run": TRACE_RUN,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+
+def reset():
+    # a fresh run starts a new trace instead of adding to the one of the previous run
+    if not TRACE_FILE:
+        return
+    with open(TRACE_FILE, "a") as trace:
+        fcntl.flock(trace, fcntl.LOCK_EX)
+        trace.truncate(0)
+
+
+def load():
+    if not TRACE_FILE or not os.path.exists(TRACE_FILE):
+        return []
+    with open(TRACE_FILE, "r") as trace:
+        fcntl.flock(trace, fcntl.LOCK_SH)
+        content = trace.read()
+    return json.loads(content)["traceEvents"] if content else []
+
+
+def flush():
+    if not TRACE_FILE or not events:
+        return
+    pending = events[:]
+    del events[: len(pending)]
+    with open(TRACE_FILE, "a+") as trace:
+        fcntl.flock(trace, fcntl.LOCK_EX)
+        trace.seek(0)
+        content = trace.read()
+        existing = json.loads(content)["traceEvents"] if content else []
+        trace.seek(0)
+        trace.truncate()
+        json.dump({"traceEvents": existing + pending, "displayTimeUnit": "ms"}, trace)
+
+
+def summary(spans, top=TRACE_TOP):
+    slowest = sorted(spans, key=lambda event: event["dur"], reverse=True)[:top]
+    if not slowest:
+        return
+    logger.info(f"Top {len(slowest)} slowest spans:")
+    for event in slowest:
+        args = ", ".join(f"{key}={val}" for key, val in event["args"].items())
+        logger.info(f'  {event["dur"] / 1e6:>9.3f}s  {event["name"]}  {args}')
+
+
+def _flush_at_exit():
+    if not TRACE_FILE:
+        return
+    flush()
+    spans = [event for event in load() if event.get("run") == TRACE_RUN]
+    if spans:
+        summary(spans)
+        logger.info(f"Trace written to {TRACE_FILE}")
+
+
+atexit.register(_flush_at_exit)
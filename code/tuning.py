@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+
+from constants import TERRAFORM_DIR
+from fsutil import atomic_write
+from plan import filter_size
+
+logger = logging.getLogger()
+
+# terraformer's -n (--retry-number) and -m (--retry-sleep-ms) control how often and how
+# far apart it retries a failed refresh of a resource, which is where rate limits hit
+DEFAULT_FLAGS = {"retry_number": 5, "retry_sleep_ms": 1000}
+RETRY_NUMBER_RANGE = (3, 10)
+RETRY_SLEEP_MS_RANGE = (250, 30000)
+TUNING_VERSION = 1
+
+
+def clamp(value, bounds):
+    return max(bounds[0], min(bounds[1], value))
+
+
+def tuning_key(job):
+    # jobs for several resource types without IDs are tuned as one
+    return job["resources"]
+
+
+class Tuner:
+    def __init__(self, path=None, overrides=None):
+        self.path = path or os.environ.get(
+            "TUNING_FILE", os.path.join(TERRAFORM_DIR, ".cache", "tuning.json")
+        )
+        self.overrides = overrides or {}
+        self.history = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as tuning:
+                data = json.load(tuning)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != TUNING_VERSION:
+            return {}
+        return data.get("resource_types", {})
+
+    def flags(self, key):
+        flags = dict(DEFAULT_FLAGS)
+        flags.update(self.history.get(key, {}).get("flags", {}))
+        for resource in key.split(","):
+            flags.update(self.overrides.get(resource, {}))
+        return flags
+
+    def apply(self, plan):
+        # jobs loaded from a manifest keep the flags written into it
+        for job in plan.jobs:
+            job.setdefault("tuning", self.flags(tuning_key(job)))
+
+    def record(self, plan, stats):
+        # stats are the RetryPolicy stats of this run; jobs restored from the import
+        # cache have none and are not counted
+        runs = {}
+        for job in plan.jobs:
+            stat = stats.get(job["name"])
+            if stat is None:
+                continue
+            run = runs.setdefault(
+                tuning_key(job),
+                {
+                    "jobs": 0,
+                    "seconds": 0.0,
+                    "values": 0,
+                    "rate_limited": 0,
+                    "retries": 0,
+                },
+            )
+            run["jobs"] += 1
+            run["seconds"] += stat["seconds"]
+            run["values"] += filter_size(job)
+            run["rate_limited"] += stat["rate_limited"]
+            run["retries"] += stat["attempts"] - 1
+
+        for key, run in runs.items():
+            entry = self.history.setdefault(key, {"runs": 0, "rate_limited": 0})
+            flags = self.next_flags(self.flags(key), run)
+            entry.update(
+                flags=flags,
+                runs=entry["runs"] + 1,
+                rate_limited=entry["rate_limited"] + run["rate_limited"],
+                seconds_per_job=round(run["seconds"] / run["jobs"], 3),
+            )
+            if run["values"]:
+                entry["values_per_second"] = round(
+                    run["values"] / max(run["seconds"], 0.001), 3
+                )
+            logger.debug(f"Tuned {key}: {run} -> {flags}")
+        return runs
+
+    @staticmethod
+    def next_flags(flags, run):
+        # back off quickly when the API pushes back, and shorten the sleep again slowly
+        # while imports run clean
+        if run["rate_limited"]:
+            return {
+                "retry_number": clamp(flags["retry_number"] + 1, RETRY_NUMBER_RANGE),
+                "retry_sleep_ms": clamp(
+                    flags["retry_sleep_ms"] * 2, RETRY_SLEEP_MS_RANGE
+                ),
+            }
+        if not run["retries"]:
+            return {
+                "retry_number": clamp(flags["retry_number"] - 1, RETRY_NUMBER_RANGE),
+                "retry_sleep_ms": clamp(
+                    int(flags["retry_sleep_ms"] * 0.8), RETRY_SLEEP_MS_RANGE
+                ),
+            }
+        return flags
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {"version": TUNING_VERSION, "resource_types": self.history}
+        atomic_write(self.path, (json.dumps(data, indent=2) + "\n").encode())
+        logger.debug(f"Wrote tuning history to {self.path}")
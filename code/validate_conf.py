@@ -1,4 +1,40 @@
-from schema import And, Optional, Or, Schema
+import hashlib
+import json
+import logging
+import os
+import re
+
+from constants import (
+    AWS_VALUE_TYPES,
+    LIST_VALUE_TYPES,
+    NESTED_ID_TYPES,
+    NESTED_RESOURCES,
+    NO_ID_RESOURCES,
+    REQUIRES_VALUES,
+    SUPPORTED_RESOURCES,
+    TERRAFORM_DIR,
+)
+from fsutil import atomic_write
+from yaml import CLoader as Loader
+from yaml import MappingNode, ScalarNode, SequenceNode
+
+logger = logging.getLogger()
+
+CONFIG_CACHE_DIR = os.environ.get(
+    "CONFIG_CACHE_DIR", os.path.join(TERRAFORM_DIR, ".cache", "conf")
+)
+# bump when the rules below change, so configs validated by older rules are not reused
+CONFIG_CACHE_VERSION = 4
+# set by orchestrate.py for the run of each org, selecting its part of conf.yaml
+ORG = os.environ.get("DD_ORG")
+
+STR_TAG = "tag:yaml.org,2002:str"
+INT_TAG = "tag:yaml.org,2002:int"
+NULL_TAG = "tag:yaml.org,2002:null"
+TYPE_TAGS = {str: STR_TAG, int: INT_TAG}
+SHARD_MODES = ("hash", "tag", "tagset")
+ORG_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+CREDENTIAL_SETTINGS = ("api_key_env", "app_key_env", "host_env")
 
 
 def list_string_example(resource, req=False):
@@ -120,306 +156,456 @@ is a list of tag combinations such as:
 """
 
 
-config_schema = Schema(
-    {
-        "resources": [
-            Optional(
-                {
-                    "all": And(
-                        None,
-                        error=no_value_example("all"),
-                    )
-                }
-            ),
-            Optional(
-                {"dashboard": Or([str], None, error=list_string_example("dashboard"))}
-            ),
-            Optional(
-                {
-                    "dashboard_list": Or(
-                        [int],
-                        None,
-                        error=list_integer_example("dashboard_list"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_archive": Or(
-                        [str],
-                        None,
-                        error=list_string_example("dashboarlogs_archived_list"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_archive_order": And(
-                        None,
-                        error=no_value_example("logs_archive_order"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_custom_pipeline": Or(
-                        [str],
-                        None,
-                        error=list_string_example("logs_custom_pipeline"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_integration_pipeline": Or(
-                        [str],
-                        None,
-                        error=list_string_example("logs_integration_pipeline"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_pipeline_order": And(
-                        None, error=no_value_example("logs_pipeline_order")
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_index": Or(
-                        [str],
-                        None,
-                        error=list_string_example("logs_pipeline_order"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "logs_index_order": And(
-                        None,
-                        error=no_value_example("logs_index_order"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_aws": Or(
-                        [
-                            Optional(
-                                {
-                                    "aws_account_ids": And(
-                                        [str, int],
-                                        error=list_string_integer_example(
-                                            "aws_account_ids", req=True
-                                        ),
-                                    )
-                                }
-                            ),
-                            Optional(
-                                {
-                                    "roles": And(
-                                        [str],
-                                        error=list_string_example("roles", req=True),
-                                    )
-                                }
-                            ),
-                            Optional(
-                                {
-                                    "account_role": And(
-                                        [str],
-                                        error=list_string_example(
-                                            "account_roles", req=True
-                                        ),
-                                    )
-                                }
-                            ),
-                        ],
-                        None,
-                        error=aws_example(),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_aws_lambda_arn": Or(
-                        [str],
-                        None,
-                        error=list_string_example("integration_aws_lambda_arn"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_aws_log_collection": Or(
-                        [str, int],
-                        None,
-                        error=list_string_integer_example(
-                            "integration_aws_log_collection"
-                        ),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_azure": Or(
-                        [str],
-                        None,
-                        error=list_string_example("integration_azure"),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_pagerduty_service_object": Or(
-                        [str],
-                        None,
-                        error=list_string_example(
-                            "integration_pagerduty_service_object"
-                        ),
-                    )
-                }
-            ),
-            Optional(
-                {
-                    "integration_slack_channel": Or(
-                        [
-                            Optional(
-                                {
-                                    "slack_account_channels": And(
-                                        [{str: [lambda x: "#" not in x]}],
-                                        error="'slack_account_channels' expects a list of dictionairies, with the key being the account name, and the value being a list of channels without the leading #.",
-                                    )
-                                }
-                            ),
-                            Optional(
-                                {
-                                    "slack_account_names": And(
-                                        [str],
-                                        error=list_string_example(
-                                            "slack_account_names", req=True
-                                        ),
-                                    )
-                                }
-                            ),
-                        ],
-                        None,
-                        error=slack_example(),
+def shards_example():
+    return f"""
+'shards' splits the output of a resource type into separate root modules, each with its own state:
+    shards:
+        monitor:
+            by: tagset
+        dashboard:
+            by: hash
+            count: 8
+        synthetics_test:
+            by: tag
+            tag: team
+'by' is one of hash (requires 'count'), tag (requires the tag key in 'tag') or tagset (uses the
+tagsets configured for the resource type under 'resources').
+"""
+
+
+def tuning_example():
+    return f"""
+'tuning' sets the Terraformer retry flags for a resource type instead of tuning them from previous runs:
+    tuning:
+        monitor:
+            retry_number: 5
+            retry_sleep_ms: 5000
+'retry_number' (-n) is how many times Terraformer retries a failed request and 'retry_sleep_ms' (-m) how
+many milliseconds it waits between retries; both are optional non-negative integers.
+"""
+
+
+def orgs_example():
+    return f"""
+'orgs' imports several Datadog orgs in one run, each into terraform/<org>:
+    orgs:
+        prod:
+            api_key_env: PROD_DD_API_KEY
+            app_key_env: PROD_DD_APP_KEY
+            resources:
+                - dashboard:
+        eu:
+            api_key_env: EU_DD_API_KEY
+            app_key_env: EU_DD_APP_KEY
+            host_env: EU_DD_HOST
+            resources:
+                - monitor:
+'api_key_env' and 'app_key_env' name the environment variables holding the org's keys, and the
+optional 'host_env' the one holding its site URL. Org names may only contain letters, digits, '-'
+and '_'. Each org takes 'resources', 'shards' and 'tuning' like the top level of conf.yaml, and
+uses the top level 'shards' and 'tuning' when it has none of its own.
+"""
+
+
+class ConfigError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("\n".join(errors))
+
+
+def is_null(node):
+    return isinstance(node, ScalarNode) and node.tag == NULL_TAG
+
+
+class Validator:
+    def __init__(self, loader):
+        self.loader = loader
+        self.errors = []
+        self.org_nodes = {}
+
+    def error(self, node, message):
+        self.errors.append(f"line {node.start_mark.line + 1}: {message.strip()}")
+
+    def value_list(self, node, types, example, check=None):
+        # a list of scalars of the given types; duplicates are dropped as they are found
+        if not isinstance(node, SequenceNode):
+            self.error(node, example)
+            return None
+        tags = {TYPE_TAGS[t] for t in types}
+        values, seen = [], set()
+        for item in node.value:
+            if (
+                not isinstance(item, ScalarNode)
+                or item.tag not in tags
+                or (check and not check(item.value))
+            ):
+                self.error(item, example)
+                continue
+            value = (
+                item.value
+                if item.tag == STR_TAG
+                else self.loader.construct_object(item)
+            )
+            if value not in seen:
+                seen.add(value)
+                values.append(value)
+        return values
+
+    def mapping_list(self, node, fields, example):
+        # a list of mappings whose keys each have their own rule, such as the
+        # ids/tags/tagsets entries of a monitor
+        if not isinstance(node, SequenceNode):
+            self.error(node, example)
+            return None
+        entries = []
+        for item in node.value:
+            if not isinstance(item, MappingNode):
+                self.error(item, example)
+                continue
+            entry = {}
+            for key_node, value_node in item.value:
+                if key_node.value not in fields:
+                    self.error(key_node, f"Unknown key '{key_node.value}'.\n{example}")
+                    continue
+                entry[key_node.value] = fields[key_node.value](self, value_node)
+            entries.append(entry)
+        return entries
+
+    def resources(self, node):
+        if is_null(node):
+            return None
+        if not isinstance(node, SequenceNode):
+            self.error(node, "'resources' expects a list of resource types")
+            return None
+        resources = []
+        for item in node.value:
+            if not isinstance(item, MappingNode):
+                self.error(item, "Each entry of 'resources' must be a resource type")
+                continue
+            for key_node, value_node in item.value:
+                resource = key_node.value
+                if resource not in SUPPORTED_RESOURCES:
+                    self.error(
+                        key_node,
+                        f"Resource type '{resource}' found in config, but it is not supported.",
                     )
-                }
-            ),
-            Optional(
-                {
-                    "metric_metadata": And(
-                        [str],
-                        error=list_string_example("metric_metadata", req=True),
+                    continue
+                resources.append({resource: RULES[resource](self, value_node)})
+        return resources
+
+    def resource_settings(self, node, section, example):
+        # a mapping from resource type to a mapping of settings, such as shards and tuning
+        if is_null(node):
+            return []
+        if not isinstance(node, MappingNode):
+            self.error(node, example)
+            return []
+        entries = []
+        for key_node, value_node in node.value:
+            resource = key_node.value
+            if resource not in SUPPORTED_RESOURCES or resource == "all":
+                self.error(
+                    key_node,
+                    f"Resource type '{resource}' found in {section}, but it is not supported.",
+                )
+                continue
+            if not isinstance(value_node, MappingNode):
+                self.error(value_node, example)
+                continue
+            entries.append((resource, value_node))
+        return entries
+
+    def shards(self, node):
+        layouts = {}
+        for resource, value_node in self.resource_settings(
+            node, "shards", shards_example()
+        ):
+            layout = {}
+            for setting, value in value_node.value:
+                if setting.value == "by" and value.value in SHARD_MODES:
+                    layout["by"] = value.value
+                elif (
+                    setting.value == "count"
+                    and value.tag == INT_TAG
+                    and int(value.value) > 0
+                ):
+                    layout["count"] = int(value.value)
+                elif setting.value == "tag" and value.tag == STR_TAG and value.value:
+                    layout["tag"] = value.value
+                else:
+                    self.error(
+                        setting,
+                        f"Invalid shard setting '{setting.value}' for {resource}.\n{shards_example()}",
                     )
-                }
-            ),
-            Optional(
-                {
-                    "monitor": Or(
-                        [
-                            {
-                                Optional("ids"): And(
-                                    [int], error=list_integer_example("ids")
-                                )
-                            },
-                            {
-                                Optional("tags"): And(
-                                    [str], error=list_string_example("tags")
-                                )
-                            },
-                            {
-                                Optional("tagsets"): And(
-                                    [{str: [str]}], error=tagset_example()
-                                )
-                            },
-                        ],
-                        None,
-                        error=nested_resource("monitor"),
+            required = {"hash": "count", "tag": "tag"}.get(layout.get("by"))
+            if "by" not in layout or (required and required not in layout):
+                self.error(value_node, shards_example())
+                continue
+            layouts[resource] = layout
+        return layouts
+
+    def sections(self, node, org=None):
+        # the sections of conf.yaml, or of one of its orgs, which also names the
+        # environment variables holding its credentials
+        config, shards_node = {}, None
+        for key_node, value_node in node.value:
+            key = key_node.value
+            if key == "resources":
+                config["resources"] = self.resources(value_node)
+            elif key == "shards":
+                config["shards"] = self.shards(value_node)
+                shards_node = key_node
+            elif key == "tuning":
+                config["tuning"] = self.tuning(value_node)
+            elif key == "orgs" and org is None:
+                config["orgs"] = self.orgs(value_node)
+            elif key in CREDENTIAL_SETTINGS and org is not None:
+                if value_node.tag == STR_TAG and value_node.value:
+                    config[key] = value_node.value
+                else:
+                    self.error(
+                        value_node,
+                        f"'{key}' of org '{org}' expects the name of an environment variable.\n{orgs_example()}",
                     )
-                }
-            ),
-            {
-                Optional("role"): Or(
-                    [str],
-                    error=list_string_example("metric_metadata"),
-                )
-            },
-            {
-                Optional("security_monitoring_default_rule"): And(
-                    [str], error=list_string_example("security_monitoring_default_rule")
-                )
-            },
-            {
-                Optional("security_monitoring_rule"): And(
-                    [str], error=list_string_example("security_monitoring_rule")
+            else:
+                self.error(key_node, f"Unknown key '{key}'")
+        return config, shards_node
+
+    def orgs(self, node):
+        if not isinstance(node, MappingNode) or not node.value:
+            self.error(node, orgs_example())
+            return {}
+        orgs = {}
+        for key_node, value_node in node.value:
+            name = key_node.value
+            if not ORG_NAME.match(name):
+                self.error(key_node, f"Invalid org name '{name}'.\n{orgs_example()}")
+                continue
+            if name in orgs:
+                self.error(key_node, f"Org '{name}' is defined more than once")
+                continue
+            if not isinstance(value_node, MappingNode):
+                self.error(value_node, orgs_example())
+                continue
+            org, shards_node = self.sections(value_node, org=name)
+            for setting in ("resources", "api_key_env", "app_key_env"):
+                if setting not in org:
+                    self.error(key_node, f"Org '{name}' has no '{setting}'")
+            self.org_nodes[name] = (key_node, shards_node)
+            orgs[name] = org
+        return orgs
+
+    def check_shards(self, config, node, scope=""):
+        for resource, layout in config.get("shards", {}).items():
+            if layout["by"] == "tagset" and not has_tagsets(config, resource):
+                self.error(
+                    node,
+                    f"'{resource}' is sharded by tagset, but has no tagsets under 'resources'{scope}",
                 )
-            },
-            Optional(
-                {
-                    "service_level_objective": Or(
-                        [
-                            {
-                                Optional("ids"): And(
-                                    [str], error=list_string_example("ids")
-                                )
-                            },
-                            {
-                                Optional("tags"): And(
-                                    [str], error=list_string_example("tags")
-                                )
-                            },
-                            {
-                                Optional("tagsets"): And(
-                                    [{str: [str]}], error=tagset_example()
-                                )
-                            },
-                        ],
-                        None,
-                        error=nested_resource("service_level_objective"),
+
+    def tuning(self, node):
+        overrides = {}
+        for resource, value_node in self.resource_settings(
+            node, "tuning", tuning_example()
+        ):
+            flags = {}
+            for setting, value in value_node.value:
+                if (
+                    setting.value in ("retry_number", "retry_sleep_ms")
+                    and value.tag == INT_TAG
+                    and int(value.value) >= 0
+                ):
+                    flags[setting.value] = int(value.value)
+                else:
+                    self.error(
+                        setting,
+                        f"Invalid tuning setting '{setting.value}' for {resource}.\n{tuning_example()}",
                     )
-                }
-            ),
-            Optional(
+            overrides[resource] = flags
+        return overrides
+
+
+def no_value_rule(resource):
+    def rule(validator, node):
+        if not is_null(node):
+            validator.error(node, no_value_example(resource))
+
+    return rule
+
+
+def value_list_rule(resource, types, required=False, check=None, example=None):
+    example = example or {
+        (str,): list_string_example,
+        (int,): list_integer_example,
+        (str, int): list_string_integer_example,
+    }[types](resource, req=required)
+
+    def rule(validator, node):
+        if is_null(node):
+            if required:
+                validator.error(node, example)
+            return None
+        return validator.value_list(node, types, example, check)
+
+    return rule
+
+
+def named_lists_rule(example, check=None):
+    # a list of mappings from an arbitrary name to a list of strings, such as tagsets
+    def rule(validator, node):
+        if not isinstance(node, SequenceNode):
+            validator.error(node, example)
+            return None
+        entries = []
+        for item in node.value:
+            if not isinstance(item, MappingNode):
+                validator.error(item, example)
+                continue
+            entries.append(
                 {
-                    "synthetics_test": Or(
-                        [
-                            {
-                                Optional("ids"): And(
-                                    [str], error=list_string_example("ids")
-                                )
-                            },
-                            {
-                                Optional("tags"): And(
-                                    [str], error=list_string_example("tags")
-                                )
-                            },
-                            {
-                                Optional("tagsets"): And(
-                                    [{str: [str]}], error=tagset_example()
-                                )
-                            },
-                        ],
-                        None,
-                        error=nested_resource("synthetics_test"),
-                    )
+                    key.value: validator.value_list(value, (str,), example, check)
+                    for key, value in item.value
                 }
+            )
+        return entries
+
+    return rule
+
+
+def mapping_list_rule(fields, example):
+    def rule(validator, node):
+        if is_null(node):
+            return None
+        return validator.mapping_list(node, fields, example)
+
+    return rule
+
+
+def compile_rules():
+    rules = {"all": no_value_rule("all")}
+    rules.update({resource: no_value_rule(resource) for resource in NO_ID_RESOURCES})
+    rules.update(
+        {
+            resource: value_list_rule(
+                resource,
+                types,
+                required=resource in REQUIRES_VALUES,
+                check=(lambda x: "pl:" in x)
+                if resource == "synthetics_private_location"
+                else None,
+            )
+            for resource, types in LIST_VALUE_TYPES.items()
+        }
+    )
+    rules.update(
+        {
+            resource: mapping_list_rule(
+                {
+                    "ids": value_list_rule("ids", NESTED_ID_TYPES[resource], True),
+                    "tags": value_list_rule("tags", (str,), True),
+                    "tagsets": named_lists_rule(tagset_example()),
+                },
+                nested_resource(resource),
+            )
+            for resource in NESTED_RESOURCES
+        }
+    )
+    rules["integration_aws"] = mapping_list_rule(
+        {
+            key: value_list_rule(key, types, True)
+            for key, types in AWS_VALUE_TYPES.items()
+        },
+        aws_example(),
+    )
+    rules["integration_slack_channel"] = mapping_list_rule(
+        {
+            "slack_account_channels": named_lists_rule(
+                "'slack_account_channels' expects a list of dictionairies, with the key being the account name, and the value being a list of channels without the leading #.",
+                check=lambda x: "#" not in x,
             ),
-            {
-                Optional("synthetics_global_variable"): Or(
-                    [str],
-                    error=list_string_example("synthetics_global_variable", req=True),
+            "slack_account_names": value_list_rule("slack_account_names", (str,), True),
+        },
+        slack_example(),
+    )
+    return rules
+
+
+RULES = compile_rules()
+
+
+def org_config(config, org):
+    # the config an org is imported with: its own sections, with the top level shards
+    # and tuning as defaults
+    if org not in config.get("orgs", {}):
+        raise ConfigError([f"Org '{org}' is not defined under 'orgs' in conf.yaml"])
+    defaults = {key: val for key, val in config.items() if key in ("shards", "tuning")}
+    return {**defaults, **config["orgs"][org]}
+
+
+def has_tagsets(config, resource):
+    return any(
+        isinstance(conf, dict) and conf.get("tagsets")
+        for resource_conf in config.get("resources") or []
+        for conf in resource_conf.get(resource) or []
+    )
+
+
+def validate(data):
+    # validates conf.yaml in a single pass over the YAML node tree, collecting every
+    # error with its line number instead of stopping at the first one
+    loader = Loader(data)
+    try:
+        node = loader.get_single_node()
+        validator = Validator(loader)
+        config = {}
+        if node is None:
+            validator.errors.append("line 1: conf.yaml must contain a 'resources' list")
+        elif not isinstance(node, MappingNode):
+            validator.error(node, "conf.yaml must contain a 'resources' list")
+        else:
+            config, shards_node = validator.sections(node)
+            if "orgs" not in config:
+                if "resources" not in config:
+                    validator.error(node, "conf.yaml must contain a 'resources' list")
+                validator.check_shards(config, shards_node)
+            elif "resources" in config:
+                validator.error(
+                    node,
+                    "conf.yaml can contain either a 'resources' list or 'orgs', not both",
                 )
-            },
-            {
-                Optional("synthetics_private_location"): And(
-                    [lambda x: "pl:" in x],
-                    error="'synthetics_private_location' expects a list of strings of private location identifiers, including the leading pl:",
+            for name, (key_node, org_shards_node) in validator.org_nodes.items():
+                validator.check_shards(
+                    org_config(config, name),
+                    org_shards_node or shards_node or key_node,
+                    f" of org '{name}'",
                 )
-            },
-            {Optional("user"): Or([str], list_string_example("user"))},
-        ]
-    },
-)
+    finally:
+        loader.dispose()
+    return config, validator.errors
+
+
+def load_config(path):
+    # the validated config is cached by the hash of the file, so every script of a run
+    # only parses and checks it once
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError('Could not find file "conf.yaml", ensure it is present')
+    digest = hashlib.sha256(data)
+    digest.update(str(CONFIG_CACHE_VERSION).encode())
+    cache_path = os.path.join(CONFIG_CACHE_DIR, f"{digest.hexdigest()}.json")
+    if os.path.exists(cache_path):
+        logger.debug(f"Using validated config from {cache_path}")
+        with open(cache_path, "r") as cached:
+            config = json.load(cached)
+    else:
+        config, errors = validate(data)
+        if errors:
+            raise ConfigError(errors)
+        try:
+            os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+            atomic_write(cache_path, json.dumps(config).encode())
+        except OSError as e:
+            logger.debug(f"Could not cache validated config: {e}")
+    return org_config(config, ORG) if ORG else config
@@ -17,19 +17,6 @@ if [ $? -ne 0 ]; then
 fi
 popd
 
-/usr/local/bin/python code/configure.py
-
-find /terraform/datadog -type f -exec sed -i -e 's/tfer--//g' {} \;
-
-/usr/local/bin/python code/migrate.py
-
-pushd /terraform
-for d in $(ls datadog)
-do
-  pushd /terraform/datadog/$d
-  /usr/bin/terraform state replace-provider -auto-approve "registry.terraform.io/-/datadog" "DataDog/datadog"
-  popd
-done
-popd
-
-for f in $(find /terraform/datadog -name 'terraform.tfstate.*.backup'); do rm $f; done
\ No newline at end of file
+# imports and migrates in one process, migrating each resource type as soon as its
+# imports are done; configure.py and migrate.py can still be run one after the other
+/usr/local/bin/python code/orchestrate.py "$@"